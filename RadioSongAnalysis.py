@@ -1,4 +1,10 @@
 from scripts.SongCollection import *
+from scripts.StationRegistry import ResponseRecorder
+from scripts.Snapshots import convertPickle
+from scripts.ReportRenderer import renderReport
+from scripts.CollectionMerge import mergeCollections
+from scripts.ShardedCollector import ShardedCollector
+from scripts.StationReplay import Recording, ReplayServer
 import signal, sys, os
 import argparse
 
@@ -14,15 +20,99 @@ def getCommandLineArguments():
     # Command - Collect
     collectParser = subparsers.add_parser('collect', help='Collect data over time')
     collectParser.add_argument('-i', '--input', type=str, required=False, default='new',
-                    help='The timestamp of the collection to load. Use \'newest\' to load the most recently saved collection.')
+                    help='The timestamp of the collection to load. Use \'newest\' to load the most recently saved collection '
+                         'or \'log\' to restore from the play log.')
     collectParser.add_argument('-w', '--wait', type=float, default=4, required=False,
                     help='The wait time to fetch the recent songs list.')
+    collectParser.add_argument('-a', '--adaptive', action='store_true',
+                    help='Schedule each station\'s polls from its observed song spacing and list depth, starting '
+                         'from the wait time')
     collectParser.add_argument('-l', '--logDir', type=str, required=False, default=None,
                     help='Redirect the program\'s log to a file')
     collectParser.add_argument('-o', '--outputDir', type=str, required=False, default='data',
                     help='The folder to write the log files to')
+    collectParser.add_argument('-s', '--store', type=str, required=False, default=None,
+                    help='Append every collected play to this SQLite play log instead of periodically saving '
+                         'the whole collection')
     collectParser.add_argument('-b', '--background', action='store_true',
                     help='Move the process into the background')
+    collectParser.add_argument('-c', '--chain', action='store_true',
+                    help='Save only the new plays each time, as deltas of a snapshot chain in the output folder')
+    collectParser.add_argument('-m', '--metrics', type=str, required=False, default=None,
+                    help='Export fetch, parse, stitch and save timings and counters to this file after every cycle')
+    collectParser.add_argument('--metricsFormat', type=str, choices=['prometheus', 'jsonl'], default='prometheus',
+                    help='Write the metrics as a Prometheus text file (replaced each cycle) or append JSON lines')
+    collectParser.add_argument('--stations', type=str, required=False, default=None,
+                    help='JSON file of the stations to collect (see StationRegistry), instead of the built-in ones')
+    collectParser.add_argument('--workers', type=int, default=0, required=False,
+                    help='Poll the stations from this many worker processes, with this process storing their plays')
+    collectParser.add_argument('-r', '--record', type=str, required=False, default=None,
+                    help='Also append every page fetched from the stations to this JSON lines file, for replay')
+
+    # Command - Replay
+    replayParser = subparsers.add_parser('replay', help='Serve recorded station pages from a local stand-in server')
+    replayParser.add_argument('recording', type=str, help='Recorded station pages (collect --record)')
+    replayParser.add_argument('-p', '--port', type=int, default=8000, required=False,
+                    help='Port to serve the stations on')
+    replayParser.add_argument('-s', '--speed', type=float, default=1, required=False,
+                    help='How many times faster than real time to replay (ex. 2000 replays a week in 5 minutes)')
+    replayParser.add_argument('-c', '--copies', type=int, default=1, required=False,
+                    help='Serve every recorded station as this many stations')
+    replayParser.add_argument('-o', '--stations', type=str, required=True,
+                    help='Write the served stations to this station file, for collect --stations')
+
+    # Command - Convert
+    convertParser = subparsers.add_parser('convert', help='Convert pickled collections to memory-mapped snapshots')
+    convertParser.add_argument('inputs', type=str, nargs='+',
+                    help='Pickled collection files, or folders of them (ex. saved/)')
+    convertParser.add_argument('-o', '--outputDir', type=str, required=True,
+                    help='The folder to write the snapshot files to (file names are kept)')
+    convertParser.add_argument('-c', '--chain', action='store_true',
+                    help='Write the collections, oldest first, as one snapshot chain of a base and deltas')
+
+    # Command - Compact
+    compactParser = subparsers.add_parser('compact', help='Fold the deltas of a snapshot chain into a new base')
+    compactParser.add_argument('folder', type=str, help='Folder of the snapshot chain')
+    compactParser.add_argument('-k', '--keep', action='store_true',
+                    help='Keep the old base and delta files instead of deleting them')
+
+    # Command - Dedupe
+    dedupeParser = subparsers.add_parser('dedupe', help='Remove stitching duplicates from a saved collection')
+    dedupeParser.add_argument('inputs', type=str, nargs='+',
+                    help='Saved collections (pickles or snapshots) to clean')
+    dedupeParser.add_argument('-o', '--outputDir', type=str, required=True,
+                    help='The folder to write the cleaned collections to as snapshots (file names are kept)')
+    dedupeParser.add_argument('-g', '--minGap', type=float, default=30, required=False,
+                    help='Minutes within which a repeat of the same song on a station counts as a duplicate')
+
+    # Command - Merge
+    mergeParser = subparsers.add_parser('merge', help='Merge saved collections into one history without duplicates')
+    mergeParser.add_argument('inputs', type=str, nargs='+',
+                    help='Saved collections (pickles, snapshots or snapshot chains) to merge')
+    mergeParser.add_argument('-o', '--output', type=str, required=True,
+                    help='The snapshot file to write the merged collection to')
+    mergeParser.add_argument('-g', '--minGap', type=float, default=30, required=False,
+                    help='Minutes within which a repeat of the same song on a station counts as a duplicate')
+
+    # Command - Compare
+    compareParser = subparsers.add_parser('compare', help='Compare the rotations of every pair of stations')
+    compareParser.add_argument('input', type=str,
+                    help='Saved collection (pickle or snapshot) to compare the stations of')
+    compareParser.add_argument('-n', '--topN', type=int, default=40, required=False,
+                    help='How many of each station\'s most played songs to check for overlap')
+
+    # Command - Report
+    reportParser = subparsers.add_parser('report', help='Render every chart of a saved collection to image files')
+    reportParser.add_argument('input', type=str,
+                    help='Saved collection (pickle or snapshot) to render')
+    reportParser.add_argument('-o', '--outputDir', type=str, required=True,
+                    help='The folder to write the charts to')
+    reportParser.add_argument('-t', '--topSongs', type=int, default=10, required=False,
+                    help='Also chart the play times of this many of each station\'s most played songs')
+    reportParser.add_argument('-w', '--workers', type=int, default=None, required=False,
+                    help='Rendering processes (default: one per CPU)')
+    reportParser.add_argument('-f', '--format', type=str, default='png', required=False,
+                    help='Image format of the charts (ex. png, svg, pdf)')
     return ap.parse_args()
 
 
@@ -36,12 +126,22 @@ if __name__ == '__main__':
 
     # Arguments
     args = getCommandLineArguments()
+    COLLECTION = None
+    SAVER = None
+    COLLECTOR = None
 
     # Establish CTRL-C handler
     def signal_handler(sig, frame):
         print('Saving collection and quitting...')
+        if COLLECTOR is not None:
+            COLLECTOR.stop()  # Store the plays the workers already sent
         if COLLECTION is not None:
-            COLLECTION.save()
+            if COLLECTION.log is not None:
+                COLLECTION.log.close()
+            elif SAVER is not None:
+                SAVER.close(COLLECTION)  # Finish the queued saves, then write the last plays
+            else:
+                COLLECTION.save()
         sys.exit(0)
     signal.signal(signal.SIGINT, signal_handler)
 
@@ -49,8 +149,17 @@ if __name__ == '__main__':
     if args.command == 'collect':
 
         # Input
-        if args.input == 'newest':
-            COLLECTION = StationPlayCollection.getMostRecentSaved()
+        if args.input == 'log':
+            if args.store is None:
+                print('[-] Restoring from the play log requires --store')
+                exit(-1)
+            print('[i] Restoring from play log %s' % args.store)
+            log = PlayLog(args.store)
+            COLLECTION = StationPlayCollection.fromLog(log)
+            log.close()  # Reopened once the collector has forked, see below
+            COLLECTION.log = None
+        elif args.input == 'newest':
+            COLLECTION = StationPlayCollection.getMostRecentSaved(args.outputDir)
         elif args.input == 'new':
             COLLECTION = StationPlayCollection()
         else:
@@ -63,6 +172,25 @@ if __name__ == '__main__':
             print('[i] Restoring %d' % timestamp)
             COLLECTION = StationPlayCollection.restore(timestamp)
 
+        # Play log
+        if args.store is not None and args.input != 'log':
+            log = PlayLog(args.store)
+            hasPlays = len(log) > 0
+            log.close()
+            if hasPlays:
+                print('[-] Play log %s already has plays, use \'--input log\' to resume from it' % args.store)
+                exit(-1)
+
+        # Snapshot chain
+        if args.chain and args.input != 'newest' and len(SnapshotChain(args.outputDir)):
+            print('[-] %s already holds a snapshot chain, use \'--input newest\' to resume from it' % args.outputDir)
+            exit(-1)
+
+        # Recording
+        if args.record and args.workers > 0:
+            print('[-] Recording is only supported without --workers')
+            exit(-1)
+
         FETCH_WAIT = args.wait
 
         if args.background:
@@ -74,8 +202,111 @@ if __name__ == '__main__':
             print('[i] Redirecting program output to %s' % args.logDir)
             sys.stdout = open(args.logDir, 'w+', 1)
 
-        # Start collecting
-        collectSongsFromStations(COLLECTION, wait=args.wait*60, folder=args.outputDir)
+        # Start collecting, saving on a background thread or to the play log. Both are only opened after the fork, as
+        # neither a thread nor an SQLite connection survives it
+        if args.store is not None:
+            COLLECTION.attachLog(PlayLog(args.store))
+        registry = StationRegistry.load(args.stations) if args.stations else defaultRegistry()
+        if args.record:
+            print('[i] Recording station pages to %s' % args.record)
+            registry.record(ResponseRecorder(args.record))
+        if COLLECTION.log is None:
+            SAVER = BackgroundSaver(args.outputDir, chain=args.chain)
+        if args.workers > 0:
+            COLLECTOR = ShardedCollector(COLLECTION, registry, workers=args.workers, wait=args.wait*60,
+                                         adaptive=args.adaptive, logFile=args.logDir)
+            COLLECTOR.run(folder=args.outputDir, saver=SAVER, metricsFile=args.metrics,
+                          metricsFormat=args.metricsFormat)
+        else:
+            collectSongsFromStations(COLLECTION, wait=args.wait*60, folder=args.outputDir, adaptive=args.adaptive,
+                                     metricsFile=args.metrics, metricsFormat=args.metricsFormat, saver=SAVER,
+                                     registry=registry)
+
+    # Handle converting
+    elif args.command == 'convert':
+        os.makedirs(args.outputDir, exist_ok=True)
+        filenames = []
+        for inputPath in args.inputs:
+            filenames += [os.path.join(inputPath, name) for name in sorted(os.listdir(inputPath))] \
+                if os.path.isdir(inputPath) else [inputPath]
+        if args.chain:
+            chain = SnapshotChain(args.outputDir)
+            for filename in sorted(filenames, key=os.path.basename):
+                folder, name = os.path.split(os.path.abspath(filename))
+                saved = chain.playCounts()
+
+                # Each collection continues the one before it, so only the plays past the saved ones are new
+                newPlays = {}
+                for stationName, songList in StationPlayCollection.restore(name, folder=folder).getLists().items():
+                    newPlays[stationName] = songList.columns.take(np.arange(saved.get(stationName, 0), songList.n))
+                entry = chain.append(newPlays, int(name) if name.isdigit() else None)
+                print('[i] %s -> %s' % (filename, entry))
+            print('[i] Chain of %d files, %d KB' % (len(chain), chain.diskUsage() // 1024))
+        else:
+            for filename in filenames:
+                if isSnapshot(filename):
+                    print('[i] Skipping %s, already a snapshot' % filename)
+                    continue
+                outputFilename = os.path.join(args.outputDir, os.path.basename(filename))
+                print('[i] Converting %s -> %s' % (filename, outputFilename))
+                convertPickle(filename, outputFilename)
+
+    # Handle compacting
+    elif args.command == 'compact':
+        started = time.time()
+        before, after = SnapshotChain(args.folder).compact(keepFiles=args.keep)
+        print('[i] Compacted %s from %d KB to %d KB in %.2f seconds' % (args.folder, before // 1024, after // 1024,
+                                                                      time.time() - started))
+
+    # Handle deduplicating
+    elif args.command == 'dedupe':
+        started = time.time()
+        for inputPath in args.inputs:
+            folder, name = os.path.split(os.path.abspath(inputPath))
+            print('[i] Cleaning %s' % inputPath)
+            cleaned, removed = StationPlayCollection.restore(name, folder=folder).removeDuplicates(args.minGap * 60)
+            cleaned.save(name, folder=args.outputDir, snapshot=True)
+            for stationName, nRemoved in removed.items():
+                print('\t%s - removed %d duplicate%s, %d plays left' %
+                      (stationName, nRemoved, '' if nRemoved == 1 else 's', len(cleaned[stationName])))
+        print('[i] Done in %.2f seconds' % (time.time() - started))
+
+    # Handle merging
+    elif args.command == 'merge':
+        started = time.time()
+        summary = mergeCollections(args.inputs, args.output, window=args.minGap * 60)
+        for stationName, counts in summary.items():
+            print('\t%s - read %d plays, kept %d, dropped %d exact and %d near duplicates' %
+                  (stationName, counts['read'], counts['kept'], counts['exact'], counts['near']))
+        print('[i] Merged %d collections into %s in %.2f seconds' % (len(args.inputs), args.output,
+                                                                   time.time() - started))
+
+    # Handle replaying
+    elif args.command == 'replay':
+        recording = Recording(args.recording)
+        server = ReplayServer(recording, speed=args.speed, copies=args.copies, port=args.port)
+        server.registry().save(args.stations)
+        print('[i] Replaying %d pages of %d stations (%.1f hours) at %gx on %s as %d stations, listed in %s' % (
+            len(recording), len(recording.stations()), (recording.end - recording.start) / 3600, args.speed,
+            server.url, len(server.sources), args.stations))
+        server.serveForever()
+
+    # Handle comparing
+    elif args.command == 'compare':
+        folder, name = os.path.split(os.path.abspath(args.input))
+        StationPlayCollection.restore(name, folder=folder).compareStations(args.topN)
+
+    # Handle reporting
+    elif args.command == 'report':
+        started = time.time()
+        folder, name = os.path.split(os.path.abspath(args.input))
+        results = renderReport(StationPlayCollection.restore(name, folder=folder), args.outputDir,
+                               workers=args.workers, topSongs=args.topSongs, fileFormat=args.format)
+        for filename, error in results.items():
+            if error is not None:
+                print('[-] %s: %s' % (filename, error))
+        print('[i] Rendered %d of %d charts to %s in %.2f seconds' % (
+            sum(error is None for error in results.values()), len(results), args.outputDir, time.time() - started))
 
     # Handle showing
     elif args.command == 'show':
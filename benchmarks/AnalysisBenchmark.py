@@ -0,0 +1,130 @@
+from benchmarks.SyntheticHistory import *
+import argparse, json, platform, subprocess, tempfile, timeit
+
+"""
+AnalysisBenchmark
+    Times the analysis and collection hot paths (popularity, selections, capture intervals, stitching a poll, appending
+    plays, chart data, station comparison, saving and restoring) on synthetic histories of several sizes and on the
+    collections in saved/. Every timing is written as one JSON line, so runs on different commits can be compared with
+    --compare.
+
+    python -m benchmarks.AnalysisBenchmark --sizes 10000 1000000 -o benchmarks/results.jsonl
+    python -m benchmarks.AnalysisBenchmark --sizes 10000 1000000 10000000 --compare benchmarks/results.jsonl
+"""
+
+def bestTime(run: Callable, setup: Callable = lambda: None, repeat: int = 3) -> float:
+    """Best of `repeat` timings of run(setup()), not counting the setup."""
+    times = []
+    for _ in range(repeat):
+        argument = setup()
+        started = timeit.default_timer()
+        run(argument)
+        times.append(timeit.default_timer() - started)
+    return min(times)
+
+
+def _pollOf(songList: SongList, nNew: int = 3, depth: int = 15) -> List[PlayedSong]:
+    """A fetched recently played list (newest first) that overlaps the stored plays and has nNew new songs."""
+    stored = songList.tail(depth - nNew)
+    newSongs = [PlayedSong.fromIds(song.song, song.stationId, song.timestamp) for song in songList.tail(depth)[:nNew]]
+    return (stored + newSongs)[::-1]
+
+
+def benchmarkCollection(collection: StationPlayCollection, repeat: int) -> Dict[str, float]:
+    """Benchmark name -> best time in seconds."""
+    songList = collection.getAllSongs()
+    topSong = songList.getMostPopular(1)[0]
+    times = {}
+
+    times['getPopularityIndices'] = bestTime(lambda _: songList.getPopularityIndices(), repeat=repeat)
+    times['select.title'] = bestTime(lambda _: songList.select(title=topSong.title), repeat=repeat)
+    times['select.hours'] = bestTime(lambda _: songList.select(hours=[7, 8, 9]), repeat=repeat)
+    times['where.count'] = bestTime(lambda _: songList.where(artist=topSong.artist, hours=[7, 8, 9]).count(),
+                                    repeat=repeat)
+    times['getCaptureIntervals'] = bestTime(lambda fresh: fresh.getCaptureIntervals(),
+                                            lambda: SongList.fromColumns(songList.columns), repeat)
+
+    # One poll: stitch a fetched list onto the stored plays, then append what was new
+    stationList = max(collection.getLists().values(), key=len)
+    times['getNewSongs'] = bestTime(lambda fetched: getNewSongs(stationList.tail(2 * len(fetched)), fetched),
+                                    lambda: _pollOf(stationList), repeat)
+    times['add'] = bestTime(lambda args: args[0].add(args[1]), lambda: (SongList.fromColumns(stationList.columns),
+                                                                          _pollOf(stationList)[:3]), repeat)
+
+    # Data behind the charts
+    times['chartData.frequency'] = bestTime(lambda _: songList.showFrequencyGraph(show=False), repeat=repeat)
+    times['chartData.fiveNumberSummary'] = bestTime(lambda stats: (stats.build(songList.columns.songKeys()),
+                                                                   stats.fiveNumberSummary()), PlayStats, repeat)
+    times['chartData.popularityByHour'] = bestTime(
+        lambda _: RadioAnalysis(collection.getLists()).getSongPopularityByHour(), repeat=repeat)
+    times['chartData.whenPlayed'] = bestTime(lambda _: np.bincount(
+        localTimeParts(songList.where(title=topSong.title).timestamps())[0], minlength=24), repeat=repeat)
+    times['compareStations'] = bestTime(lambda _: collection.getSongMatrix().compare(), repeat=repeat)
+
+    # Persistence
+    with tempfile.TemporaryDirectory() as folder:
+        for name, snapshot in [('snapshot', True), ('pickle', False)]:
+            times['save.' + name] = bestTime(lambda _: collection.save(0, folder, snapshot=snapshot), repeat=repeat)
+            times['restore.' + name] = bestTime(lambda _: StationPlayCollection.restore(0, folder).getLists(),
+                                                repeat=repeat)
+    return times
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _loadResults(filename: str) -> Dict[Tuple[str, str], float]:
+    """(suite, benchmark) -> seconds, keeping the last run of each in the file."""
+    results = {}
+    with open(filename) as fp:
+        for line in fp:
+            if line.strip():
+                result = json.loads(line)
+                results[(result['suite'], result['benchmark'])] = result['seconds']
+    return results
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser('Analysis and collection benchmark')
+    ap.add_argument('-s', '--sizes', type=int, nargs='*', default=[10000, 1000000],
+                    help='Synthetic history sizes in plays (ex. 10000 1000000 10000000)')
+    ap.add_argument('--stations', type=int, default=3, help='Stations in each synthetic history')
+    ap.add_argument('--catalog', type=int, default=1000, help='Songs in the synthetic catalog')
+    ap.add_argument('--saved', type=str, default='saved',
+                    help='Folder of saved collections to benchmark too (empty for none)')
+    ap.add_argument('-n', '--repeat', type=int, default=3, help='Timing repetitions (the best one is reported)')
+    ap.add_argument('-o', '--output', type=str, default=None, help='Append the results to this JSON lines file')
+    ap.add_argument('-c', '--compare', type=str, default=None, help='JSON lines file of an earlier run to compare with')
+    args = ap.parse_args()
+
+    suites = [('synthetic/%d' % size, lambda size=size: generateHistory(args.stations, args.catalog, plays=size))
+              for size in args.sizes]
+    if args.saved:
+        suites += [('%s/%s' % (args.saved, name), lambda name=name: StationPlayCollection.restore(name, args.saved))
+                   for name in sorted(os.listdir(args.saved))]
+
+    baseline = _loadResults(args.compare) if args.compare else {}
+    environment = {'commit': _commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                   'machine': platform.machine(), 'time': int(time.time())}
+    output = open(args.output, 'a') if args.output else None
+
+    for suite, load in suites:
+        started = timeit.default_timer()
+        collection = load()
+        plays = sum(len(songList) for songList in collection.getLists().values())
+        print('%s: %d plays, %d stations (loaded in %.2f s)' % (suite, plays, len(collection.getLists()),
+                                                                timeit.default_timer() - started))
+        for benchmark, seconds in benchmarkCollection(collection, args.repeat).items():
+            previous = baseline.get((suite, benchmark))
+            print('\t%-28s %10.3f ms%s' % (benchmark, seconds * 1000,
+                                          '  %6.2fx' % (previous / seconds) if previous else ''))
+            if output:
+                output.write(json.dumps(dict(environment, suite=suite, plays=plays, benchmark=benchmark,
+                                             seconds=seconds, repeat=args.repeat)) + '\n')
+    if output:
+        output.close()
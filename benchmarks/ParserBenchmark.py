@@ -0,0 +1,71 @@
+from scripts.StationInterfaces import *
+import argparse, os, timeit
+
+"""
+ParserBenchmark
+    Times each station parser on recorded copies of the station pages, comparing the full-document BeautifulSoup parse
+    with the targeted fast path, and checks that both find the same songs. Record the current pages once with --record,
+    then rerun on the same files to compare changes.
+
+    python -m benchmarks.ParserBenchmark --pages benchmarks/pages --record
+    python -m benchmarks.ParserBenchmark --pages benchmarks/pages
+"""
+
+# Station -> (recorded file name, page URL, parser)
+RECORDED_PAGES = {
+    'Air1': ('Air1.html', AIR1_URL_RECENTLY_PLAYED, parseAIR1),
+    'KISS': ('KISS.html', KISS_URL_RECENTLY_PLAYED, parseKISS),
+    'FISH': ('FISH.html', FISH_URL_RECENTLY_PLAYED, parseFISH),
+}
+
+
+def recordPages(folder: str) -> None:
+    os.makedirs(folder, exist_ok=True)
+    session = createSession()
+    for stationName, (filename, url, _) in RECORDED_PAGES.items():
+        try:
+            page = session.get(url, timeout=DEFAULT_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            print('[-] Could not record %s: %s' % (stationName, e.__class__.__name__))
+            continue
+        with open(os.path.join(folder, filename), 'w', encoding='utf-8') as fp:
+            fp.write(page.text)
+        print('[i] Recorded %s (%d KB)' % (stationName, len(page.content) // 1024))
+
+
+def benchmarkParsers(folder: str, repeat: int) -> None:
+    print('%-6s %8s %12s %12s %8s  %s' % ('Station', 'KB', 'full (ms)', 'fast (ms)', 'speedup', 'songs'))
+    for stationName, (filename, _, parse) in RECORDED_PAGES.items():
+        filepath = os.path.join(folder, filename)
+        if not os.path.exists(filepath):
+            print('%-6s  no recorded page (%s)' % (stationName, filepath))
+            continue
+        with open(filepath, encoding='utf-8') as fp:
+            page = fp.read()
+
+        # Both paths have to agree before their times mean anything
+        try:
+            fullSongs = [(song.title, song.artist, song.album) for song in parse(page, fast=False)]
+            fastSongs = [(song.title, song.artist, song.album) for song in parse(page, fast=True)]
+        except Exception as e:
+            print('%-6s  parser failed on the recorded page: %r' % (stationName, e))
+            continue
+        if fullSongs != fastSongs:
+            print('[-] %s: fast parser found %s, full parser found %s' % (stationName, fastSongs, fullSongs))
+
+        fullTime = min(timeit.repeat(lambda: parse(page, fast=False), number=1, repeat=repeat))
+        fastTime = min(timeit.repeat(lambda: parse(page, fast=True), number=1, repeat=repeat))
+        print('%-6s %8d %12.2f %12.2f %7.1fx  %d' % (stationName, len(page) // 1024, fullTime * 1000, fastTime * 1000,
+                                                    fullTime / fastTime, len(fastSongs)))
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser('Station parser benchmark')
+    ap.add_argument('-p', '--pages', type=str, default='benchmarks/pages', help='Folder of recorded station pages')
+    ap.add_argument('-r', '--record', action='store_true', help='Download the current station pages first')
+    ap.add_argument('-n', '--repeat', type=int, default=20, help='Timing repetitions (the best one is reported)')
+    args = ap.parse_args()
+
+    if args.record:
+        recordPages(args.pages)
+    benchmarkParsers(args.pages, args.repeat)
@@ -0,0 +1,113 @@
+from benchmarks.SyntheticHistory import *
+from scripts.StationReplay import *
+from scripts.ShardedCollector import ShardedCollector
+import argparse, contextlib, io, sys, tempfile
+
+"""
+ReplayBenchmark
+    Load tests the collector offline: a recording (or a synthetic one) is replayed time-compressed from a local
+    ReplayServer, scaled to many synthetic stations, and collected by a ShardedCollector pointed at it. Reports the
+    requests served, plays stored per second and how many plays were missed or extra compared with stitching every
+    recorded page. The synthetic recording has stations with published play times (K-LOVE style) and without (Air1
+    style, stitched by song order). Once the replay ends, one worker is killed, so the run also checks that the collector
+    restarts it and can still be stopped. Exits with 1 when more plays than --maxMissing were missed or stored twice, or when
+    the collector did not stop, so it can gate CI.
+
+    python -m benchmarks.ReplayBenchmark --days 7 --speed 2000 --copies 20 --workers 4
+    python -m benchmarks.ReplayBenchmark --recording responses.jsonl --speed 600 --copies 50
+"""
+
+
+def runReplay(recording: Recording, speed: float, copies: int, workers: int, wait: float, seconds: float = None,
+              killWorker: bool = True) -> Tuple[ReplayServer, StationPlayCollection, float]:
+    """Collect from a replay of the recording until it ends (or for `seconds`), then freeze the replay clock and give
+    every station time to be polled once more, so the reference can stop at the same replay time. With killWorker, the
+    first worker is terminated once the clock is frozen (so no plays are missed while it restarts) and restarted by
+    checkWorkers. Returns the server, what was collected and the seconds it took. Raises RuntimeError if the collector
+    does not stop."""
+    server = ReplayServer(recording, speed=speed, copies=copies)
+    collection = StationPlayCollection()
+    collector = ShardedCollector(collection, server.registry(), workers=workers, wait=wait)
+    server.startInBackground()
+    started = time.time()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # Every stored poll prints a line
+            collector.start()
+            while not server.done and (seconds is None or time.time() - started < seconds):
+                collector.receive(timeout=0.5)
+                collector.checkWorkers()
+            server.freeze()
+            if killWorker:
+                collector.workers[0].process.terminate()
+                collector.workers[0].process.join()
+                collector.checkWorkers()
+            caughtUp = time.time() + 2 * wait + 1
+            while time.time() < caughtUp:
+                collector.receive(timeout=0.5)
+
+            # A killed worker must not keep the others from being stopped
+            stopping = threading.Thread(target=collector.stop, name='stop', daemon=True)
+            stopping.start()
+            stopping.join(4 * DEFAULT_TIMEOUT)
+            if stopping.is_alive():
+                raise RuntimeError('The collector did not stop')
+    finally:
+        server.close()
+    return server, collection, time.time() - started
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser('Collector replay load test')
+    ap.add_argument('-r', '--recording', type=str, default=None,
+                    help='Recorded station pages (collect --record), instead of a synthetic recording')
+    ap.add_argument('--stations', type=int, default=3, help='Stations in the synthetic recording')
+    ap.add_argument('--days', type=float, default=1, help='Days of plays in the synthetic recording')
+    ap.add_argument('--every', type=float, default=60, help='Seconds between recorded polls in the synthetic recording')
+    ap.add_argument('-s', '--speed', type=float, default=2000, help='How many times faster than real time to replay')
+    ap.add_argument('-c', '--copies', type=int, default=10, help='Synthetic stations to serve per recorded station')
+    ap.add_argument('-w', '--workers', type=int, default=4, help='Collector worker processes')
+    ap.add_argument('--wait', type=float, default=0.2, help='Real seconds between polls of a station')
+    ap.add_argument('--seconds', type=float, default=None, help='Stop after this many seconds')
+    ap.add_argument('--keepWorkers', action='store_true',
+                    help='Don\'t kill a worker at the end to check that it is restarted and the collector still stops')
+    ap.add_argument('--maxMissing', type=float, default=0.01,
+                    help='Largest share of the expected plays that may be missed (or stored twice) before exiting with '
+                         'an error')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = args.recording
+        if filename is None:
+            filename = os.path.join(folder, 'synthetic.jsonl')
+            pages = writeSyntheticRecording(filename, generateHistory(args.stations, days=args.days), every=args.every)
+            print('[i] Recorded %d synthetic pages' % pages)
+        recording = Recording(filename)
+        print('[i] Replaying %d pages of %d stations (%.1f hours) as %d stations at %gx' % (
+            len(recording), len(recording.stations()), (recording.end - recording.start) / 3600,
+            len(recording.stations()) * args.copies, args.speed))
+
+        try:
+            server, collection, seconds = runReplay(recording, args.speed, args.copies, args.workers, args.wait,
+                                                    args.seconds, not args.keepWorkers)
+        except RuntimeError as e:
+            print('[-] %s' % e)
+            sys.exit(1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            reference = referenceCollection(recording, until=server.replayTime())
+        results = compareWithReference(collection, reference, server.sources)
+        recording.close()
+
+    expected = sum(result['expected'] for result in results.values())
+    stored = sum(result['collected'] for result in results.values())
+    missing = sum(result['missing'] for result in results.values())
+    extra = sum(result['extra'] for result in results.values())
+    print('[i] %d requests in %.1f s (%.0f/s), %d plays stored (%.0f/s)' % (
+        server.served, seconds, server.served / seconds, stored, stored / seconds))
+    print('[i] %d plays expected, %d missed (%.2f%%), %d extra' % (expected, missing,
+                                                                   100 * missing / max(expected, 1), extra))
+    worst = sorted(results.items(), key=lambda item: -item[1]['missing'] - item[1]['extra'])[:5]
+    for stationName, result in worst:
+        if result['missing'] or result['extra']:
+            print('\t%s - missed %d and stored %d extra of %d' % (stationName, result['missing'], result['extra'],
+                                                                  result['expected']))
+    sys.exit(1 if max(missing, extra) > args.maxMissing * expected else 0)
@@ -0,0 +1,67 @@
+import argparse, os, re, subprocess, sys, time
+from typing import List, Tuple
+
+"""
+StartupBenchmark
+    Measures how long the collector takes to start: the wall time of importing each entry module in a fresh interpreter
+    and, from `python -X importtime`, the modules that cost the most. Fails (exit code 1) when a module that the
+    collector should only load on first use (matplotlib, bs4) is imported at startup, or when an entry module takes
+    longer than the budget, so import-time regressions show up.
+
+    python -m benchmarks.StartupBenchmark
+    python -m benchmarks.StartupBenchmark --budget 250 --top 15
+"""
+
+# Modules the collector imports at startup
+ENTRY_MODULES = ['scripts.SongCollection', 'scripts.ReportRenderer', 'RadioSongAnalysis']
+
+# Libraries that must only be imported when first used
+LAZY_MODULES = ['matplotlib', 'bs4']
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def importWallTime(module: str, repeat: int) -> float:
+    """Best wall time in seconds of starting an interpreter that imports the module, minus a bare interpreter's."""
+    def best(code: str) -> float:
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True)
+            times.append(time.perf_counter() - started)
+        return min(times)
+    return best('import %s' % module) - best('pass')
+
+
+def importProfile(module: str) -> Tuple[List[Tuple[int, int, str]], List[str]]:
+    """(self us, cumulative us, module) of every module imported, and the lazy modules that were imported."""
+    check = 'import sys, %s; print(" ".join(name for name in %r if name in sys.modules))' % (module, LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], check=True, capture_output=True,
+                            text=True)
+    profile = [(int(selfTime), int(cumulative), name) for selfTime, cumulative, _, name in
+               IMPORT_TIME_LINE.findall(result.stderr)]
+    return profile, result.stdout.split()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser('Collector startup benchmark')
+    ap.add_argument('-b', '--budget', type=float, default=None, help='Fail if an entry module takes longer (ms)')
+    ap.add_argument('-t', '--top', type=int, default=10, help='Slowest imports to list for each entry module')
+    ap.add_argument('-n', '--repeat', type=int, default=5, help='Timing repetitions (the best one is reported)')
+    args = ap.parse_args()
+
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    failed = False
+    for module in ENTRY_MODULES:
+        wallTime = importWallTime(module, args.repeat) * 1000
+        profile, loadedLazily = importProfile(module)
+        print('%s: %.1f ms' % (module, wallTime))
+        for selfTime, cumulative, name in sorted(profile, key=lambda entry: -entry[1])[:args.top]:
+            print('\t%8.1f ms  %s' % (cumulative / 1000, name))
+        if loadedLazily:
+            print('[-] %s imports %s at startup' % (module, ', '.join(loadedLazily)))
+            failed = True
+        if args.budget is not None and wallTime > args.budget:
+            print('[-] %s is over the %.0f ms budget' % (module, args.budget))
+            failed = True
+    sys.exit(1 if failed else 0)
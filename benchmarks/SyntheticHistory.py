@@ -0,0 +1,44 @@
+from scripts.SongCollection import *
+
+"""
+SyntheticHistory
+    Generates play histories that look like a real station's: each station rotates through its own part of a shared
+    catalog, its most played songs are played far more often than the rest (Zipf-like, play share ~ 1 / rank^s) and a
+    song starts every few minutes, around the clock. Histories are built straight into PlayColumns, so millions of plays
+    take seconds.
+"""
+
+DAY = 24 * 60 * 60
+
+
+def generateStation(stationName: str, songIds: np.ndarray, nPlays: int, rotation: float = 1.1,
+                    spacing: float = 3.5 * 60, start: float = 1561939200, rng: np.random.Generator = None) -> PlayColumns:
+    """nPlays plays of the songs in songIds (most played first) on one station, a song every `spacing` seconds or so."""
+    rng = np.random.default_rng() if rng is None else rng
+    popularity = 1 / np.arange(1, len(songIds) + 1) ** rotation
+    plays = songIds[rng.choice(len(songIds), size=nPlays, p=popularity / popularity.sum())]
+    timestamps = start + np.cumsum(rng.uniform(0.7 * spacing, 1.3 * spacing, size=nPlays))
+    stationIds = np.full(nPlays, CATALOG.internStation(stationName), dtype=np.int16)
+    return PlayColumns(plays.astype(np.int32), stationIds, timestamps)
+
+
+def generateHistory(nStations: int = 3, catalogSize: int = 1000, stationCatalogSize: int = 300, days: float = None,
+                    plays: int = None, rotation: float = 1.1, spacing: float = 3.5 * 60,
+                    seed: int = 0) -> StationPlayCollection:
+    """A collection of nStations synthetic stations. Give either `days` of plays per station or `plays` in total.
+    Each station plays stationCatalogSize songs of the shared catalog in its own order of popularity."""
+    if (days is None) == (plays is None):
+        raise RuntimeError('Give either the days or the number of plays to generate')
+    rng = np.random.default_rng(seed)
+    catalog = np.array([CATALOG.internSong('Song %d' % i, 'Artist %d' % (i % max(catalogSize // 4, 1)), None).id
+                        for i in range(catalogSize)], dtype=np.int32)
+    playsPerStation = [int(days * DAY / spacing)] * nStations if days is not None else \
+        [plays // nStations + (i < plays % nStations) for i in range(nStations)]
+
+    collection = StationPlayCollection()
+    for i, nPlays in enumerate(playsPerStation):
+        stationName = 'Synthetic %d' % (i + 1)
+        songIds = rng.permutation(catalog)[:stationCatalogSize]
+        collection.songLists[stationName] = SongList.fromColumns(
+            generateStation(stationName, songIds, nPlays, rotation, spacing, rng=rng))
+    return collection
@@ -0,0 +1,164 @@
+from scripts.SongCollection import *
+from scripts.Snapshots import SnapshotWriter
+from abc import ABC, abstractmethod
+from collections import deque
+import heapq
+
+"""
+CollectionMerge
+    Merges any number of saved collections (from collector runs that overlap or diverge) into one history without
+    double counting. Each station is merged on its own: the plays of every input are streamed in time order and combined
+    with a heap-based k-way merge, a play of a song that was already kept within the last `window` seconds on that
+    station is dropped as a duplicate, and the kept plays are streamed into a new snapshot.
+
+    Snapshot inputs (and the files of a snapshot chain) are read through mmap in chunks, so memory stays bounded by the
+    number of inputs and the plays inside one window. Pickles have to be unpickled whole, convert them first when that
+    matters.
+"""
+
+MERGE_CHUNK = 64 * 1024  # Plays read from an input, or written to the output, at a time
+
+
+class _MergeInput(ABC):
+    """One input's plays of each station, in time order and in chunks, with songs as (title, artist, album) numbers of
+    the merged output."""
+
+    def __init__(self, name: str, writer: SnapshotWriter):
+        self.name = name
+        self.writer = writer
+        self.outputNumbers = None  # type: np.ndarray  # Input song number -> output song number, -1 until needed
+
+    @abstractmethod
+    def stations(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def _chunks(self, stationName: str) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """(input song numbers, timestamps) chunks of one station, in time order."""
+
+    @abstractmethod
+    def _songFields(self, song: int) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """(title, artist, album) of an input song number."""
+
+    def plays(self, stationName: str) -> Iterator[Tuple[float, int]]:
+        """(timestamp, output song number) of every play of the station, in time order."""
+        for songs, timestamps in self._chunks(stationName):
+            missing = np.unique(songs[self.outputNumbers[songs] < 0])
+            for song in missing.tolist():
+                self.outputNumbers[song] = self.writer.songNumber(*self._songFields(song))
+            yield from zip(timestamps.tolist(), self.outputNumbers[songs].tolist())
+
+
+class _SnapshotInput(_MergeInput):
+
+    def __init__(self, filename: str, writer: SnapshotWriter):
+        super().__init__(filename, writer)
+        self.snapshot = Snapshot(filename)
+        self.outputNumbers = np.full(len(self.snapshot._songTable), -1, dtype=np.int64)
+
+    def stations(self) -> List[str]:
+        return self.snapshot.getStations()
+
+    def _chunks(self, stationName: str) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        first, count = self.snapshot.stations.get(stationName, (0, 0))
+        for start in range(first, first + count, MERGE_CHUNK):
+            records = self.snapshot.records[start:min(start + MERGE_CHUNK, first + count)]
+            yield records['song'].astype(np.int64), records['timestamp']
+
+    def _songFields(self, song: int) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        return self.snapshot.songFields(song)
+
+
+class _CollectionInput(_MergeInput):
+    """A collection that had to be loaded whole (a pickle). Its songs are numbered by catalog id."""
+
+    def __init__(self, name: str, collection: StationPlayCollection, writer: SnapshotWriter):
+        super().__init__(name, writer)
+        self.collection = collection
+
+    def stations(self) -> List[str]:
+        return list(self.collection.getLists().keys())
+
+    def _chunks(self, stationName: str) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        if stationName not in self.collection.getLists():
+            return
+        columns = self.collection[stationName].columns
+        order = np.argsort(columns.timestamps, kind='stable')
+        if self.outputNumbers is None or len(self.outputNumbers) < len(CATALOG.songs):
+            grown = np.full(len(CATALOG.songs), -1, dtype=np.int64)
+            if self.outputNumbers is not None:
+                grown[:len(self.outputNumbers)] = self.outputNumbers
+            self.outputNumbers = grown
+        for start in range(0, len(order), MERGE_CHUNK):
+            positions = order[start:start + MERGE_CHUNK]
+            yield columns.songIds[positions].astype(np.int64), columns.timestamps[positions]
+
+    def _songFields(self, song: int) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        song = CATALOG.songs[song]
+        return song.title, song.artist, song.album
+
+
+def _openInputs(path: str, writer: SnapshotWriter) -> List[_MergeInput]:
+    """A snapshot file, every file of a snapshot chain, or a pickled collection."""
+    if isChain(path):
+        chain = SnapshotChain(path)
+        return [_SnapshotInput(os.path.join(path, entry['name']), writer) for entry in chain.files]
+    if isSnapshot(path):
+        return [_SnapshotInput(path, writer)]
+    folder, name = os.path.split(os.path.abspath(path))
+    return [_CollectionInput(path, StationPlayCollection.restore(name, folder=folder), writer)]
+
+
+def mergeStationPlays(streams: List[Iterator[Tuple[float, int]]], window: float
+                      ) -> Iterator[Tuple[float, int, Optional[str]]]:
+    """K-way merge of time ordered (timestamp, song) streams. Yields (timestamp, song, duplicate): duplicate is None for
+    a play that is kept, 'exact' when the same song was kept at the same time and 'near' when it was kept less than
+    `window` seconds before."""
+    recent = deque()  # (timestamp, song) of the kept plays inside the window
+    lastKept = {}  # type: Dict[int, float]  # Song -> time it was last kept, for the songs in recent
+    for timestamp, song in heapq.merge(*streams):
+        while recent and timestamp - recent[0][0] >= window:
+            oldTimestamp, oldSong = recent.popleft()
+            if lastKept.get(oldSong) == oldTimestamp:
+                del lastKept[oldSong]
+        if song in lastKept:
+            yield timestamp, song, 'exact' if lastKept[song] == timestamp else 'near'
+            continue
+        lastKept[song] = timestamp
+        recent.append((timestamp, song))
+        yield timestamp, song, None
+
+
+def mergeCollections(inputs: List[str], outputFilename: str, window: float = MIN_PLAY_GAP) -> Dict[str, Dict[str, int]]:
+    """Merge saved collections (snapshot files, snapshot chains or pickles) into one snapshot file. Returns station ->
+    {'read', 'kept', 'exact', 'near'} play counts, exact and near being the duplicates dropped at the same time as a
+    kept play or within the window after one."""
+    writer = SnapshotWriter(outputFilename)
+    try:
+        sources = [source for path in inputs for source in _openInputs(path, writer)]
+        stationNames = []
+        for source in sources:
+            stationNames += [name for name in source.stations() if name not in stationNames]
+
+        summary = {}
+        for stationName in stationNames:
+            counts = summary[stationName] = {'read': 0, 'kept': 0, 'exact': 0, 'near': 0}
+            songs, timestamps = [], []
+            for timestamp, song, duplicate in mergeStationPlays([source.plays(stationName) for source in sources],
+                                                                window):
+                counts['read'] += 1
+                if duplicate is not None:
+                    counts[duplicate] += 1
+                    continue
+                counts['kept'] += 1
+                songs.append(song)
+                timestamps.append(timestamp)
+                if len(songs) >= MERGE_CHUNK:
+                    writer.addPlays(stationName, np.array(songs), np.array(timestamps))
+                    songs, timestamps = [], []
+            writer.addPlays(stationName, np.array(songs, dtype=np.int64), np.array(timestamps, dtype=np.float64))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return summary
@@ -0,0 +1,193 @@
+import bisect, json, os, threading, time
+from typing import Dict, List, Tuple
+
+"""
+Metrics
+    Counters, gauges and latency histograms for the collector, kept in the process-wide METRICS registry and labelled by
+    station. The collector times each stage (fetch, parse, stitch, save) through METRICS.timer and exports everything
+    after each cycle as a Prometheus text file (for node_exporter's textfile collector) or as JSON lines. Metrics are off
+    unless enabled, and then every call returns right away. Collector worker processes have registries of their own,
+    which they drain into their heartbeats for the writer to merge into its registry and export.
+"""
+
+PREFIX = 'radio_'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Seconds
+
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: 'Histogram') -> None:
+        self.counts = [count + otherCount for count, otherCount in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulativeCounts(self) -> List[int]:
+        output, total = [], 0
+        for count in self.counts:
+            total += count
+            output.append(total)
+        return output
+
+
+class _Timer:
+    """Context manager that records the seconds spent inside it into a histogram."""
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def _labelKey(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _formatLabels(labels: Tuple[Tuple[str, str], ...], extra: str = None) -> str:
+    parts = ['%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{%s}' % ','.join(parts) if parts else ''
+
+
+class Metrics:
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters = {}  # type: Dict[Tuple[str, tuple], float]
+        self.gauges = {}  # type: Dict[Tuple[str, tuple], float]
+        self.histograms = {}  # type: Dict[Tuple[str, tuple], Histogram]
+        self.lock = threading.Lock()  # Stations are fetched on several threads
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, _labelKey(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(name, _labelKey(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, _labelKey(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        """`with METRICS.timer('fetch_seconds', station=name):` records how long the block took."""
+        return _Timer(self, name, labels) if self.enabled else _NO_TIMER
+
+    def drain(self) -> dict:
+        """Everything recorded since the last drain: counters and histograms are handed over and start again from
+        zero, gauges are copied. Pass it to merge() in another process."""
+        with self.lock:
+            drained = {'counters': self.counters, 'gauges': dict(self.gauges), 'histograms': self.histograms}
+            self.counters, self.histograms = {}, {}
+        return drained
+
+    def merge(self, drained: dict) -> None:
+        """Add what another registry drained to this one."""
+        if not self.enabled:
+            return
+        with self.lock:
+            for key, value in drained['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(drained['gauges'])
+            for key, histogram in drained['histograms'].items():
+                if key in self.histograms:
+                    self.histograms[key].merge(histogram)
+                else:
+                    self.histograms[key] = histogram
+
+    def toPrometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(name for name, _ in series)):
+                    lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+                    for (seriesName, labels), value in sorted(series.items()):
+                        if seriesName == name:
+                            lines.append('%s%s%s %r' % (PREFIX, name, _formatLabels(labels), value))
+            for name in sorted(set(name for name, _ in self.histograms)):
+                lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+                for (seriesName, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if seriesName != name:
+                        continue
+                    bounds = [repr(float(bound)) for bound in histogram.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, histogram.cumulativeCounts()):
+                        lines.append('%s%s_bucket%s %d' % (PREFIX, name, _formatLabels(labels, 'le="%s"' % bound), count))
+                    lines.append('%s%s_sum%s %r' % (PREFIX, name, _formatLabels(labels), histogram.sum))
+                    lines.append('%s%s_count%s %d' % (PREFIX, name, _formatLabels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def toJson(self) -> dict:
+        with self.lock:
+            return {
+                'time': time.time(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                                'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'],
+                                                    histogram.cumulativeCounts()))}
+                               for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])],
+            }
+
+    def export(self, filename: str, format: str = 'prometheus') -> None:
+        """Write the Prometheus text file (replaced atomically, so scrapers never see half of it) or append one JSON
+        line."""
+        if not self.enabled:
+            return
+        if format == 'prometheus':
+            temporary = filename + '.tmp'
+            with open(temporary, 'w') as fp:
+                fp.write(self.toPrometheus())
+            os.replace(temporary, filename)
+        elif format == 'jsonl':
+            with open(filename, 'a') as fp:
+                fp.write(json.dumps(self.toJson()) + '\n')
+        else:
+            raise RuntimeError('Unknown metrics format %s' % format)
+
+
+METRICS = Metrics()  # Shared by the collector, enabled with collect --metrics
@@ -0,0 +1,101 @@
+from scripts.SongClasses import *
+import sqlite3, os
+
+"""
+PlayLog
+    A durable, append-only log of the plays that a StationPlayCollection accepts. It is kept in SQLite in WAL mode, so
+    every poll costs one small transaction that is proportional to the number of new plays rather than the size of the
+    whole history, and a collection can be restored from it on startup.
+"""
+
+
+class PlayLog:
+
+    def __init__(self, filename: str = 'data/plays.db'):
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # WAL stays consistent on a crash at this level
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS songs (id INTEGER PRIMARY KEY, title TEXT, '
+                                    'artist TEXT, album TEXT, UNIQUE (title, artist, album))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS stations (id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS plays (station INTEGER, song INTEGER, timestamp REAL)')
+
+        # Catalog song/station ids -> row ids in this log
+        self._songRows = {}  # type: Dict[int, int]
+        self._stationRows = {}  # type: Dict[int, int]
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM plays').fetchone()[0]
+
+    def _songRow(self, song: Song) -> int:
+        row = self._songRows.get(song.id)
+        if row is None:
+            self.connection.execute('INSERT OR IGNORE INTO songs (title, artist, album) VALUES (?, ?, ?)',
+                                    (song.title, song.artist, song.album))
+            row = self._songRows[song.id] = self.connection.execute(
+                'SELECT id FROM songs WHERE title IS ? AND artist IS ? AND album IS ?',
+                (song.title, song.artist, song.album)).fetchone()[0]
+        return row
+
+    def _stationRow(self, stationId: int) -> int:
+        row = self._stationRows.get(stationId)
+        if row is None:
+            stationName = CATALOG.stationNames[stationId]
+            self.connection.execute('INSERT OR IGNORE INTO stations (name) VALUES (?)', (stationName,))
+            row = self._stationRows[stationId] = self.connection.execute(
+                'SELECT id FROM stations WHERE name = ?', (stationName,)).fetchone()[0]
+        return row
+
+    def append(self, songs: List[PlayedSong]) -> None:
+        """Append plays to the log in a single transaction."""
+        if not songs:
+            return
+        with self.connection:
+            rows = [(self._stationRow(song.stationId), self._songRow(song.song), song.timestamp) for song in songs]
+            self.connection.executemany('INSERT INTO plays (station, song, timestamp) VALUES (?, ?, ?)', rows)
+
+    def appendColumns(self, columns: PlayColumns) -> None:
+        """Append plays that are already in columnar form (ex. to seed a new log from a restored collection)."""
+        if not len(columns):
+            return
+        with self.connection:
+            songRows = {songId: self._songRow(CATALOG.songs[songId]) for songId in np.unique(columns.songIds).tolist()}
+            stationRows = {stationId: self._stationRow(stationId) for stationId in np.unique(columns.stationIds).tolist()}
+            rows = zip([stationRows[stationId] for stationId in columns.stationIds.tolist()],
+                       [songRows[songId] for songId in columns.songIds.tolist()],
+                       columns.timestamps.tolist())
+            self.connection.executemany('INSERT INTO plays (station, song, timestamp) VALUES (?, ?, ?)', rows)
+
+    def readStations(self) -> Dict[str, PlayColumns]:
+        """Read the whole log back as one PlayColumns per station, in the order the plays were appended."""
+        plays = self.connection.execute('SELECT station, song, timestamp FROM plays ORDER BY rowid').fetchall()
+        if not plays:
+            return {}
+        stationRows, songRows, timestamps = zip(*plays)
+        stationRows = np.array(stationRows, dtype=np.int64)
+        timestamps = np.array(timestamps, dtype=np.float64)
+
+        # Translate the log's row ids into this process's catalog ids
+        songLookup = np.zeros(max(songRows) + 1, dtype=np.int32)
+        for row, title, artist, album in self.connection.execute('SELECT id, title, artist, album FROM songs'):
+            if row < len(songLookup):
+                songLookup[row] = CATALOG.internSong(title, artist, album).id
+        songIds = songLookup[np.array(songRows, dtype=np.int64)]
+
+        output = {}
+        for stationRow, stationName in self.connection.execute('SELECT id, name FROM stations'):
+            positions = np.flatnonzero(stationRows == stationRow)
+            if not len(positions):
+                continue
+            stationId = CATALOG.internStation(stationName)
+            output[stationName] = PlayColumns(songIds[positions], np.full(len(positions), stationId, dtype=np.int16),
+                                              timestamps[positions])
+        return output
+
+    def close(self) -> None:
+        self.connection.close()
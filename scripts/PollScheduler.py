@@ -0,0 +1,82 @@
+from scripts.SongClasses import *
+
+"""
+PollScheduler
+    Decides when to poll each station next. A station's recently played list only covers its last few songs, so it has
+    to be polled again before that many new songs have aired or plays are lost between polls. The scheduler learns each
+    station's song spacing and list depth from past polls and schedules the next poll as late as that allows.
+"""
+
+
+class StationPollState:
+    """What the scheduler has observed about one station."""
+
+    def __init__(self, interval: float):
+        self.interval = interval  # Seconds until the next poll
+        self.nextPoll = 0.0  # Poll right away
+        self.lastPoll = None  # type: Optional[float]
+        self.depth = None  # type: Optional[float]  # Songs in the station's recently played list
+        self.spacing = None  # type: Optional[float]  # Seconds between song starts
+
+    def __repr__(self):
+        return '<StationPollState every %.0fs, depth %s, spacing %s>' % (self.interval, self.depth, self.spacing)
+
+
+class PollScheduler:
+
+    SMOOTHING = 0.3  # Weight of the newest observation in the running depth and spacing estimates
+    SAFETY_SONGS = 2  # Songs of overlap to keep between consecutive polls of a station
+
+    def __init__(self, stationNames: List[str], wait: float, adaptive: bool = True,
+                 minWait: float = 30, maxWait: float = 30 * 60):
+        """With adaptive off every station is simply polled each `wait` seconds. Otherwise `wait` is the first guess."""
+        self.adaptive = adaptive
+        self.minWait = minWait
+        self.maxWait = maxWait
+        self.stations = dict((name, StationPollState(wait)) for name in stationNames)
+
+    def _smooth(self, old: Optional[float], new: float) -> float:
+        return new if old is None else (1 - self.SMOOTHING) * old + self.SMOOTHING * new
+
+    def dueStations(self, now: float = None) -> List[str]:
+        now = time.time() if now is None else now
+        return [name for name, state in self.stations.items() if state.nextPoll <= now]
+
+    def nextPollTime(self) -> float:
+        return min(state.nextPoll for state in self.stations.values())
+
+    def record(self, stationName: str, fetched: List[PlayedSong], added: List[PlayedSong], now: float = None) -> float:
+        """Learn from one poll of a station (the songs fetched and the songs that were new) and schedule its next poll.
+        Returns the seconds until that poll."""
+        now = time.time() if now is None else now
+        state = self.stations[stationName]
+        elapsed = None if state.lastPoll is None else now - state.lastPoll
+        state.lastPoll = now
+
+        if self.adaptive and fetched:
+            state.depth = self._smooth(state.depth, len(fetched))
+
+            # Song spacing from the play times the station published, otherwise from how many new songs showed up since
+            # the last poll (songs dated when they were scraped are only moments apart)
+            timestamps = sorted(set(song.timestamp for song in fetched)) if hasPublishedTimes(fetched) else []
+            if len(timestamps) > 1:
+                state.spacing = self._smooth(state.spacing, (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1))
+            elif elapsed is not None and added:
+                state.spacing = self._smooth(state.spacing, elapsed / len(added))
+
+            if state.spacing is not None:
+                state.interval = max(state.depth - self.SAFETY_SONGS, 1) * state.spacing
+
+            # Everything was new, so songs may have been missed: come back twice as soon
+            if elapsed is not None and len(added) >= len(fetched):
+                state.interval /= 2
+
+            state.interval = min(max(state.interval, self.minWait), self.maxWait)
+
+        state.nextPoll = now + state.interval
+        return state.interval
+
+    def showSchedule(self, now: float = None) -> str:
+        now = time.time() if now is None else now
+        return ', '.join('%s in %.1f min' % (name, max(state.nextPoll - now, 0) / 60)
+                         for name, state in sorted(self.stations.items(), key=lambda item: item[1].nextPoll))
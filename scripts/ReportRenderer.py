@@ -0,0 +1,95 @@
+from scripts.SongCollection import *
+from concurrent.futures import ProcessPoolExecutor
+import os, re
+
+"""
+ReportRenderer
+    Renders every chart of a collection to image files without a display: per station charts (frequency curve, play
+    count box-and-whisker, time coverage, capture intervals, popularity by hour), play time charts for each station's
+    most played songs and the cross-station comparisons. Charts are independent, so they are fanned out over a pool of
+    worker processes that each receive the station data once, when they start.
+"""
+
+# Chart name -> function(songList, filename, **options) for the charts drawn from one station's plays
+STATION_CHARTS = {
+    'frequency': lambda songList, filename: songList.showFrequencyGraph(filename=filename),
+    'playCounts': lambda songList, filename: SongList._showBoxAndWhisker(
+        songList.stats.fiveNumberSummary(), xlabel='Plays per song', filename=filename),
+    'coverage': lambda songList, filename: songList.showTimeCoverage(filename=filename),
+    'captureIntervals': lambda songList, filename: songList.showCaptureIntervals(filename=filename),
+    'popularityByHour': lambda songList, filename: RadioAnalysis({'': songList}).showSongPopularityByHour('', filename),
+}
+SONG_CHARTS = {
+    'byHour': lambda songList, filename, title, artist: songList.showWhenPlayed(
+        byHour=True, title=title, artist=artist, filename=filename),
+    'byDay': lambda songList, filename, title, artist: songList.showWhenPlayed(
+        byHourAndDay=True, title=title, artist=artist, filename=filename),
+}
+
+_stationLists = {}  # type: Dict[str, SongList]  # Station data of this worker process
+
+
+def _initWorker(stationLists: Dict[str, SongList]) -> None:
+    global _stationLists
+    _stationLists = stationLists
+
+
+def _fileSafe(name: str) -> str:
+    return re.sub(r'[^\w\-. ]', '', name).strip() or '_'
+
+
+def _renderChart(job: Tuple[str, Optional[str], str, dict]) -> Tuple[str, Optional[str]]:
+    """Render one chart in a worker. Returns (filename, error message or None)."""
+    chart, stationName, filename, options = job
+    try:
+        if stationName is None:
+            collection = StationPlayCollection()
+            collection.songLists = _stationLists
+            if chart == 'compareFrequencies':
+                collection.compareAllFrequencies(title='Song frequencies by station', filename=filename)
+            else:
+                RadioAnalysis(_stationLists).showSongPopularityByHour(filename=filename)
+        elif chart in STATION_CHARTS:
+            STATION_CHARTS[chart](_stationLists[stationName], filename)
+        else:
+            SONG_CHARTS[chart](_stationLists[stationName], filename, **options)
+    except Exception as e:
+        return filename, '%s: %s' % (e.__class__.__name__, e)
+    return filename, None
+
+
+def getReportJobs(collection: StationPlayCollection, folder: str, topSongs: int = 10,
+                  fileFormat: str = 'png') -> List[Tuple[str, Optional[str], str, dict]]:
+    """Every chart of the report as (chart, station name or None for all stations, output file, options)."""
+    jobs = []
+    if len(collection.getLists()) > 1:
+        jobs.append(('compareFrequencies', None, os.path.join(folder, 'frequencies.%s' % fileFormat), {}))
+    jobs.append(('popularityByHour', None, os.path.join(folder, 'popularityByHour.%s' % fileFormat), {}))
+
+    for stationName, songList in collection.getLists().items():
+        stationFolder = os.path.join(folder, _fileSafe(stationName))
+        for chart in STATION_CHARTS:
+            jobs.append((chart, stationName, os.path.join(stationFolder, '%s.%s' % (chart, fileFormat)), {}))
+        for rank, song in enumerate(songList.getMostPopular(topSongs) if topSongs else [], 1):
+            for chart in SONG_CHARTS:
+                filename = '%02d %s - %s.%s' % (rank, _fileSafe(song.title or ''), chart, fileFormat)
+                jobs.append((chart, stationName, os.path.join(stationFolder, 'songs', filename),
+                             {'title': song.title, 'artist': song.artist}))
+    return jobs
+
+
+def renderReport(collection: StationPlayCollection, folder: str, workers: int = None, topSongs: int = 10,
+                 fileFormat: str = 'png') -> Dict[str, Optional[str]]:
+    """Write every chart of the collection under folder, rendering on `workers` processes (default: one per CPU, 1
+    renders in this process). Returns output file -> error message, None for the charts that were written."""
+    jobs = getReportJobs(collection, folder, topSongs, fileFormat)
+    for directory in set(os.path.dirname(job[2]) for job in jobs):
+        os.makedirs(directory, exist_ok=True)
+
+    stationLists = collection.getLists()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _initWorker(stationLists)
+        return dict(map(_renderChart, jobs))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(stationLists,)) as executor:
+        return dict(executor.map(_renderChart, jobs, chunksize=max(len(jobs) // (4 * workers), 1)))
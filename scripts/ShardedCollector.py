@@ -0,0 +1,261 @@
+from scripts.SongCollection import *
+from scripts.StationRegistry import Station
+import multiprocessing, signal, sys
+from multiprocessing.connection import Connection, wait as waitForConnections
+
+"""
+ShardedCollector
+    Collects a few hundred stations at once. The registry's stations are split over N worker processes, each polling
+    its own shard with a StationFetcher and PollScheduler and stitching every fetch onto the latest plays of the
+    station. Stitched plays are sent to the writer (the process that started the workers), which is the only one that
+    owns the collection, its play log and its saves.
+
+    Each worker talks to the writer over its own pipes, so a worker that crashes, or hangs and is killed, can only break
+    its own channels. Workers send a heartbeat with their counters every HEARTBEAT_INTERVAL. A worker that exits or
+    stays silent for longer than the heartbeat timeout is restarted with the latest stored plays of its stations, while
+    the rest of the fleet keeps polling. The writer stops each worker with a message on a pipe of its own (nothing is
+    shared between the workers that a killed one could leave locked), and a worker also stops once that pipe is closed
+    because the writer has gone.
+"""
+
+HEARTBEAT_INTERVAL = 30  # Seconds between a worker's health reports
+HEARTBEAT_TIMEOUT = 5 * 60  # A worker silent for longer than this is restarted
+WORKER_TAIL = 2 * STITCH_TAIL  # Latest plays of each station that a worker stitches fetches onto
+
+
+def shardStations(stationNames: List[str], nWorkers: int) -> List[List[str]]:
+    """Deal the stations out to nWorkers shards, round robin, so every shard gets as many stations as it can."""
+    return [stationNames[i::nWorkers] for i in range(min(nWorkers, len(stationNames)))]
+
+
+def _collectorWorker(stations: List[Station], tails: Dict[str, List[PlayedSong]], wait: float, adaptive: bool,
+                     connection: Connection, control: Connection, logFile: Optional[str], metrics: bool) -> None:
+    """Poll one shard of stations until the writer sends ('stop',) on control or closes it, sending
+    ('plays', station, StitchResult) for every fetch and ('health', pid, counters, metrics) at least every
+    HEARTBEAT_INTERVAL, with the metrics recorded since the last one (see Metrics.drain) if metrics is set."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The writer stops the workers on CTRL-C
+    if logFile:
+        sys.stdout = open(logFile, 'a', 1)
+    METRICS.enabled = metrics
+
+    registry = StationRegistry(stations)
+    fetcher = StationFetcher(registry.scrapers(), timeouts=registry.timeouts())
+    scheduler = PollScheduler(list(registry.scrapers()), wait, adaptive=adaptive)
+    counters = {'polls': 0, 'unchanged': 0, 'failed': 0, 'plays': 0, 'gaps': 0}
+    lastHeartbeat = 0.0
+    try:
+        while not control.poll():
+            for stationName, songs in fetcher.fetchAll(scheduler.dueStations()):
+                counters['polls'] += 1
+                if not songs:
+                    counters['unchanged' if songs is None else 'failed'] += 1
+                    scheduler.record(stationName, [], [])
+                    continue
+                tail = tails.setdefault(stationName, [])
+                stitch = stitchSongs(tail[-max(2 * len(songs), STITCH_TAIL):], songs)
+                counters['plays'] += len(stitch.newSongs)
+                if tail and stitch.gap:
+                    counters['gaps'] += 1
+                connection.send(('plays', stationName, stitch))
+                tails[stationName] = (tail + stitch.newSongs)[-WORKER_TAIL:]
+                scheduler.record(stationName, songs, stitch.newSongs)
+
+            # Sleep until the next poll, waking up to report health. A stop message or a closed control pipe (the
+            # writer is gone) both make it readable
+            while True:
+                if time.time() - lastHeartbeat >= HEARTBEAT_INTERVAL:
+                    lastHeartbeat = time.time()
+                    connection.send(('health', os.getpid(), dict(counters), METRICS.drain() if metrics else None))
+                untilPoll = scheduler.nextPollTime() - time.time()
+                untilHeartbeat = lastHeartbeat + HEARTBEAT_INTERVAL - time.time()
+                if untilPoll <= 0 or control.poll(max(min(untilPoll, untilHeartbeat), 0)):
+                    break
+        # A last report, so the writer also gets the metrics recorded since the previous heartbeat
+        connection.send(('health', os.getpid(), dict(counters), METRICS.drain() if metrics else None))
+    except (BrokenPipeError, EOFError, OSError):
+        pass  # The writer is gone
+    finally:
+        fetcher.close()
+        connection.close()
+        control.close()
+
+
+class CollectorWorker:
+    """The writer's side of one worker: its shard, process, pipe and last health report."""
+
+    def __init__(self, workerId: int, stationNames: List[str]):
+        self.workerId = workerId
+        self.stationNames = stationNames
+        self.process = None  # type: Optional[multiprocessing.Process]
+        self.connection = None  # type: Optional[Connection]
+        self.control = None  # type: Optional[Connection]  # The writer's end of the worker's stop pipe
+        self.pid = None  # type: Optional[int]
+        self.lastHeartbeat = None  # type: Optional[float]
+        self.counters = {}  # type: Dict[str, int]
+        self.restarts = 0
+
+    def __repr__(self):
+        return '<CollectorWorker %d: %d stations, pid %s, %d restarts>' % (self.workerId, len(self.stationNames),
+                                                                          self.pid, self.restarts)
+
+
+class ShardedCollector:
+
+    def __init__(self, collection: StationPlayCollection, registry: StationRegistry = None, workers: int = 4,
+                 wait: float = 5 * 60, adaptive: bool = False, heartbeatTimeout: float = HEARTBEAT_TIMEOUT,
+                 logFile: str = None):
+        self.collection = collection
+        self.registry = defaultRegistry() if registry is None else registry
+        self.wait = wait
+        self.adaptive = adaptive
+        self.heartbeatTimeout = heartbeatTimeout
+        self.logFile = logFile
+        self.context = multiprocessing.get_context('spawn')  # The writer runs threads (the saver), so don't fork it
+        self.stopping = False
+        self.workers = [CollectorWorker(workerId, stationNames) for workerId, stationNames in
+                        enumerate(shardStations([station.name for station in self.registry.enabled()], workers))]
+
+    def start(self) -> None:
+        for worker in self.workers:
+            self._startWorker(worker)
+
+    def _startWorker(self, worker: CollectorWorker) -> None:
+        """Start (or restart) a worker, handing it the latest stored plays of its stations to stitch onto."""
+        storedStations = self.collection.getStations()
+        tails = dict((stationName, self.collection[stationName].tail(WORKER_TAIL))
+                     for stationName in worker.stationNames if stationName in storedStations)
+        stations = [self.registry[stationName] for stationName in worker.stationNames]
+        receiving, sending = self.context.Pipe(duplex=False)
+        controlReceiving, controlSending = self.context.Pipe(duplex=False)
+        worker.process = self.context.Process(
+            target=_collectorWorker, name='collector-%d' % worker.workerId, daemon=True,
+            args=(stations, tails, self.wait, self.adaptive, sending, controlReceiving, self.logFile,
+                  METRICS.enabled))
+        worker.process.start()
+        sending.close()  # Only the worker writes to it, so the pipe ends when the worker does
+        controlReceiving.close()  # Only the worker reads it, so it sees the pipe end when the writer does
+        worker.connection = receiving
+        worker.control = controlSending
+        worker.pid = worker.process.pid
+        worker.lastHeartbeat = time.time()
+
+    def _handle(self, worker: CollectorWorker, message: tuple) -> None:
+        worker.lastHeartbeat = time.time()
+        if message[0] == 'plays':
+            _, stationName, stitch = message
+            self.collection.addStitched(stationName, stitch)
+        elif message[0] == 'health':
+            _, worker.pid, worker.counters, metrics = message
+            if metrics is not None:
+                METRICS.merge(metrics)
+
+    def _drain(self, worker: CollectorWorker) -> int:
+        """Handle everything a worker has sent so far. Closes its pipe once the worker has gone."""
+        handled = 0
+        try:
+            while worker.connection.poll():
+                self._handle(worker, worker.connection.recv())
+                handled += 1
+        except (EOFError, OSError):
+            worker.connection.close()
+            worker.connection = None
+        return handled
+
+    def receive(self, timeout: float) -> int:
+        """Wait up to timeout seconds for the workers to send something and store it. Returns the messages handled."""
+        connections = dict((worker.connection, worker) for worker in self.workers if worker.connection is not None)
+        if not connections:
+            time.sleep(timeout)
+            return 0
+        return sum(self._drain(connections[connection]) for connection in waitForConnections(list(connections), timeout))
+
+    def checkWorkers(self, now: float = None) -> List[int]:
+        """Restart every worker that exited or stopped sending heartbeats. Returns their ids."""
+        now = time.time() if now is None else now
+        restarted = []
+        for worker in self.workers:
+            alive = worker.process.is_alive()
+            METRICS.set('worker_heartbeat_age_seconds', now - worker.lastHeartbeat, worker=worker.workerId)
+            if alive and now - worker.lastHeartbeat <= self.heartbeatTimeout:
+                continue
+            if alive:
+                print('[-] Collector worker %d stopped responding, restarting it' % worker.workerId)
+                worker.process.terminate()
+            else:
+                print('[-] Collector worker %d exited with code %s, restarting it' % (worker.workerId,
+                                                                                     worker.process.exitcode))
+            worker.process.join(DEFAULT_TIMEOUT)
+            if worker.connection is not None:
+                self._drain(worker)  # Store what it sent before it went down, so its replacement stitches onto it
+                if worker.connection is not None:
+                    worker.connection.close()
+            worker.control.close()
+            worker.restarts += 1
+            METRICS.inc('worker_restarts_total', worker=worker.workerId)
+            self._startWorker(worker)
+            restarted.append(worker.workerId)
+        return restarted
+
+    def showHealth(self, now: float = None) -> None:
+        now = time.time() if now is None else now
+        for worker in self.workers:
+            counters = worker.counters
+            print('[i] Worker %d (pid %s, %d stations): %d polls, %d unchanged, %d failed, %d plays, %d gaps, '
+                  'heartbeat %.0f s ago, %d restart%s' % (
+                      worker.workerId, worker.pid, len(worker.stationNames), counters.get('polls', 0),
+                      counters.get('unchanged', 0), counters.get('failed', 0), counters.get('plays', 0),
+                      counters.get('gaps', 0), now - worker.lastHeartbeat, worker.restarts,
+                      '' if worker.restarts == 1 else 's'))
+
+    def run(self, folder: str = None, saver: BackgroundSaver = None, metricsFile: str = None,
+            metricsFormat: str = 'prometheus') -> None:
+        """Start the workers and store what they send until stopped, saving every two waits like
+        collectSongsFromStations."""
+        if metricsFile is not None:
+            METRICS.enabled = True
+        if saver is None and self.collection.log is None:
+            saver = BackgroundSaver(folder or 'data')
+        print('[i] Collecting %d stations with %d workers' % (sum(len(worker.stationNames) for worker in self.workers),
+                                                           len(self.workers)))
+        self.start()
+        lastSave = lastCheck = time.time()
+        while not self.stopping:
+            self.receive(timeout=1)
+            now = time.time()
+            if now - lastCheck < HEARTBEAT_INTERVAL:
+                continue
+            lastCheck = now
+            self.checkWorkers(now)
+
+            if now - lastSave >= 2 * self.wait:
+                lastSave = now
+                self.collection.showStats()
+                self.showHealth(now)
+                if self.collection.log is None:
+                    if saver.submit(self.collection):
+                        print('[i] Saving collection in the background (%s)' % datetime.now().strftime("%I:%M"))
+                    else:
+                        print('[-] Previous saves are still being written, saving later')
+
+            METRICS.set('plays_stored', sum(len(songList) for songList in self.collection.songLists.values()))
+            if metricsFile is not None:
+                METRICS.export(metricsFile, metricsFormat)
+
+    def stop(self) -> None:
+        """Stop the workers and store the plays they had already sent."""
+        self.stopping = True
+        for worker in self.workers:
+            try:
+                worker.control.send(('stop',))
+            except OSError:
+                pass  # The worker is already gone (BrokenPipeError)
+        deadline = time.time() + 2 * DEFAULT_TIMEOUT  # Time for the polls in flight to finish
+        while time.time() < deadline and any(worker.process.is_alive() for worker in self.workers):
+            self.receive(timeout=0.5)
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(DEFAULT_TIMEOUT)
+            if worker.connection is not None:
+                self._drain(worker)
+            worker.control.close()
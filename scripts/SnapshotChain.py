@@ -0,0 +1,112 @@
+from scripts.Snapshots import *
+import json
+
+"""
+SnapshotChain
+    A folder of snapshot files that together hold a collection: one full base snapshot followed by delta snapshots that
+    each hold only the plays added since the file before it. Saving writes one small delta instead of the whole history,
+    and compaction folds the deltas into a new base. manifest.json lists the files of the chain in order, so finding and
+    loading the latest state never needs a directory listing.
+
+    manifest.json   {"version": 1, "sequence": 7, "latest": 1563115871,
+                     "files": [{"name": "000001-1562864300.base", "kind": "base", "timestamp": ..., "plays": ...,
+                                "stations": {"Air1": ..., ...}, "bytes": ...}, {"name": "000002-1562944841.delta", ...}]}
+"""
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def isChain(folder: str) -> bool:
+    return os.path.isdir(folder) and os.path.exists(os.path.join(folder, MANIFEST))
+
+
+class SnapshotChain:
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.manifest = {'version': MANIFEST_VERSION, 'sequence': 0, 'latest': None, 'files': []}
+        filepath = os.path.join(folder, MANIFEST)
+        if os.path.exists(filepath):
+            with open(filepath) as fp:
+                self.manifest = json.load(fp)
+            if self.manifest.get('version') != MANIFEST_VERSION:
+                raise RuntimeError('Unsupported snapshot chain version %s' % self.manifest.get('version'))
+
+    def __len__(self):
+        return len(self.manifest['files'])
+
+    @property
+    def latest(self) -> Optional[int]:
+        """Timestamp of the newest save in the chain."""
+        return self.manifest['latest']
+
+    @property
+    def files(self) -> List[dict]:
+        return self.manifest['files']
+
+    def playCounts(self) -> Dict[str, int]:
+        """Plays of each station saved in the chain, from the manifest alone."""
+        output = {}
+        for entry in self.files:
+            for stationName, plays in entry['stations'].items():
+                output[stationName] = output.get(stationName, 0) + plays
+        return output
+
+    def diskUsage(self) -> int:
+        return sum(entry['bytes'] for entry in self.files)
+
+    def _writeManifest(self) -> None:
+        def write(path: str):
+            with open(path, 'w') as fp:
+                json.dump(self.manifest, fp, indent=1)
+        replaceAtomically(os.path.join(self.folder, MANIFEST), write)
+
+    def _writeFile(self, kind: str, stations: Dict[str, PlayColumns], timestamp: int) -> dict:
+        self.manifest['sequence'] += 1
+        name = '%06d-%d.%s' % (self.manifest['sequence'], timestamp, kind)
+        filepath = os.path.join(self.folder, name)
+        replaceAtomically(filepath, lambda path: writeSnapshot(path, stations))
+        return {'name': name, 'kind': kind, 'timestamp': timestamp,
+                'plays': sum(len(columns) for columns in stations.values()),
+                'stations': dict((stationName, len(columns)) for stationName, columns in stations.items()),
+                'bytes': os.path.getsize(filepath)}
+
+    def append(self, stations: Dict[str, PlayColumns], timestamp: int = None) -> Optional[str]:
+        """Save the plays added since the last save as a delta (the first save of a chain is its base). The manifest is
+        only replaced once the file is on disk, so a crash leaves the chain as it was. Returns the file's name, or None
+        if there was nothing new."""
+        stations = dict((name, columns) for name, columns in stations.items() if len(columns))
+        if not stations and self.files:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        entry = self._writeFile('delta' if self.files else 'base', stations, timestamp)
+        self.files.append(entry)
+        self.manifest['latest'] = timestamp
+        self._writeManifest()
+        return entry['name']
+
+    def read(self, start: float = None, end: float = None) -> Dict[str, PlayColumns]:
+        """Every station's plays in [start, end), base first and then each delta in order."""
+        output = {}  # type: Dict[str, PlayColumns]
+        for entry in self.files:
+            snapshot = Snapshot(os.path.join(self.folder, entry['name']))
+            for stationName in snapshot.getStations():
+                output.setdefault(stationName, PlayColumns()).extend(snapshot.readStation(stationName, start, end))
+        return output
+
+    def compact(self, keepFiles: bool = False) -> Tuple[int, int]:
+        """Fold the base and every delta into a new base snapshot, then delete the old files (unless keepFiles).
+        Returns the chain's size on disk in bytes before and after."""
+        before = self.diskUsage()
+        if len(self.files) < 2:
+            return before, before
+        oldFiles = [entry['name'] for entry in self.files]
+        entry = self._writeFile('base', self.read(), self.manifest['latest'])
+        self.manifest['files'] = [entry]
+        self._writeManifest()
+        if not keepFiles:
+            for name in oldFiles:
+                os.remove(os.path.join(self.folder, name))
+        return before, self.diskUsage()
@@ -0,0 +1,249 @@
+from scripts.SongClasses import *
+import mmap, os, shutil, struct
+from typing import Callable
+
+"""
+Snapshots
+    A binary snapshot format for saved collections that can be opened with mmap and read through NumPy views, so
+    nothing is unpickled up front. A snapshot holds a fixed-width record table (song, timestamp) grouped by station and
+    sorted by time within each station, a song table and station table that point into a UTF-8 string table. Only the
+    stations and time ranges that a query touches are turned into SongLists.
+
+    Layout (little endian, every section 8-byte aligned):
+        header          MAGIC, version, nStations, nSongs, nRecords and the offset of each section
+        station table   nStations x uint64 [name offset, name length, first record, record count]
+        song table      nSongs x uint32 [title offset, title length, artist offset, ..., album length]
+        string table    UTF-8 bytes
+        record table    nRecords x (uint32 song, float64 timestamp)
+"""
+
+SNAPSHOT_MAGIC = b'RSNP'
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct('<4sIQQQQQQQ')  # magic, version, nStations, nSongs, nRecords, 4 section offsets
+RECORD_DTYPE = np.dtype([('song', '<u4'), ('timestamp', '<f8')])
+NO_STRING = 0xFFFFFFFF  # Length used for a missing (None) field
+
+
+def isSnapshot(filename: str) -> bool:
+    with open(filename, 'rb') as fp:
+        return fp.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def replaceAtomically(filepath: str, write: Callable[[str], None]) -> None:
+    """Write a file through write(temporary path), flush it to disk and rename it over filepath. A crash mid-write
+    leaves the previous file (and a stray .tmp that getMostRecentSaved ignores), never a truncated one."""
+    temporary = filepath + '.tmp'
+    try:
+        write(temporary)
+        with open(temporary, 'rb+') as fp:
+            os.fsync(fp.fileno())
+        os.replace(temporary, filepath)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    # Make the rename itself durable
+    try:
+        folder = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(folder)
+    except OSError:
+        pass
+    finally:
+        os.close(folder)
+
+
+class _StringTable:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def add(self, value: Optional[str]) -> Tuple[int, int]:
+        """(offset, length) of a newly added string, with NO_STRING as the length of None."""
+        if value is None:
+            return 0, NO_STRING
+        encoded = value.encode('utf-8')
+        self.data.extend(encoded)
+        return len(self.data) - len(encoded), len(encoded)
+
+
+def _writeSections(fp, stationTable: np.ndarray, songTable: np.ndarray, strings: _StringTable, nRecords: int,
+                   records) -> None:
+    """Write the header and every section. records is the record table as bytes or as a file to copy it from."""
+    stationOffset = _align(HEADER.size)
+    songOffset = _align(stationOffset + stationTable.nbytes)
+    stringOffset = _align(songOffset + songTable.nbytes)
+    recordOffset = _align(stringOffset + len(strings.data))
+
+    fp.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(stationTable), len(songTable), nRecords,
+                         stationOffset, songOffset, stringOffset, recordOffset))
+    for offset, data in ((stationOffset, stationTable.tobytes()), (songOffset, songTable.tobytes()),
+                         (stringOffset, bytes(strings.data)), (recordOffset, records)):
+        fp.write(b'\0' * (offset - fp.tell()))
+        if isinstance(data, bytes):
+            fp.write(data)
+        else:
+            shutil.copyfileobj(data, fp)
+
+
+def writeSnapshot(filename: str, stations: Dict[str, PlayColumns]) -> None:
+    """Write one PlayColumns per station to a snapshot file."""
+    # Songs used by any station, renumbered 0..nSongs-1
+    allSongIds = [columns.songIds for columns in stations.values()]
+    catalogIds = np.unique(np.concatenate(allSongIds)) if allSongIds else np.zeros(0, dtype=np.int32)
+
+    strings = _StringTable()
+    songTable = np.zeros((len(catalogIds), 6), dtype='<u4')
+    for i, songId in enumerate(catalogIds.tolist()):
+        song = CATALOG.songs[songId]
+        songTable[i] = strings.add(song.title) + strings.add(song.artist) + strings.add(song.album)
+
+    # Records grouped by station, in time order within each station
+    stationTable = np.zeros((len(stations), 4), dtype='<u8')
+    records = np.zeros(sum(len(columns) for columns in stations.values()), dtype=RECORD_DTYPE)
+    start = 0
+    for i, (stationName, columns) in enumerate(stations.items()):
+        order = np.argsort(columns.timestamps, kind='stable')
+        records['song'][start:start + len(columns)] = np.searchsorted(catalogIds, columns.songIds[order])
+        records['timestamp'][start:start + len(columns)] = columns.timestamps[order]
+        stationTable[i] = strings.add(stationName) + (start, len(columns))
+        start += len(columns)
+
+    with open(filename, 'wb') as fp:
+        _writeSections(fp, stationTable, songTable, strings, len(records), records.tobytes())
+
+
+class SnapshotWriter:
+    """Writes a snapshot whose plays arrive in pieces, station after station and in time order within each station
+    (ex. the output of a merge), without holding the plays in memory. Records go to a temporary file next to the
+    snapshot, and close() writes the tables in front of them."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._records = open(filename + '.records', 'w+b')
+        self._songNumbers = {}  # type: Dict[Tuple[str, str, str], int]
+        self._stations = []  # type: List[List]  # [name, first record, record count]
+        self.nRecords = 0
+
+    def songNumber(self, title: Optional[str], artist: Optional[str], album: Optional[str]) -> int:
+        """The snapshot's number for a song, assigned the first time the song is seen."""
+        return self._songNumbers.setdefault((title, artist, album), len(self._songNumbers))
+
+    def addPlays(self, stationName: str, songs: np.ndarray, timestamps: np.ndarray) -> None:
+        """Append plays (songs numbered with songNumber) to the station being written, or start the next station."""
+        if not self._stations or self._stations[-1][0] != stationName:
+            if any(station[0] == stationName for station in self._stations):
+                raise RuntimeError('Plays of %s have to be written together' % stationName)
+            self._stations.append([stationName, self.nRecords, 0])
+        records = np.zeros(len(songs), dtype=RECORD_DTYPE)
+        records['song'] = songs
+        records['timestamp'] = timestamps
+        self._records.write(records.tobytes())
+        self._stations[-1][2] += len(records)
+        self.nRecords += len(records)
+
+    def close(self) -> None:
+        strings = _StringTable()
+        songTable = np.zeros((len(self._songNumbers), 6), dtype='<u4')
+        for (title, artist, album), number in self._songNumbers.items():
+            songTable[number] = strings.add(title) + strings.add(artist) + strings.add(album)
+        stationTable = np.zeros((len(self._stations), 4), dtype='<u8')
+        for i, (stationName, start, count) in enumerate(self._stations):
+            stationTable[i] = strings.add(stationName) + (start, count)
+
+        def write(path: str):
+            self._records.seek(0)
+            with open(path, 'wb') as fp:
+                _writeSections(fp, stationTable, songTable, strings, self.nRecords, self._records)
+        try:
+            replaceAtomically(self.filename, write)
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Drop the plays written so far without writing the snapshot."""
+        self._records.close()
+        if os.path.exists(self._records.name):
+            os.remove(self._records.name)
+
+
+class Snapshot:
+    """A memory-mapped snapshot file. Opening one only reads the header and station table."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, nStations, nSongs, nRecords, stationOffset, songOffset, stringOffset, recordOffset = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise RuntimeError('%s is not a snapshot file' % filename)
+        if version != SNAPSHOT_VERSION:
+            raise RuntimeError('Unsupported snapshot version %d' % version)
+
+        self._stationTable = np.frombuffer(self._map, dtype='<u8', count=nStations * 4, offset=stationOffset).reshape(-1, 4)
+        self._songTable = np.frombuffer(self._map, dtype='<u4', count=nSongs * 6, offset=songOffset).reshape(-1, 6)
+        self._stringOffset = stringOffset
+        self.records = np.frombuffer(self._map, dtype=RECORD_DTYPE, count=nRecords, offset=recordOffset)
+
+        # Station name -> (first record, record count)
+        self.stations = {}  # type: Dict[str, Tuple[int, int]]
+        for nameOffset, nameLength, start, count in self._stationTable.tolist():
+            self.stations[self._string(nameOffset, nameLength)] = (start, count)
+
+        # Snapshot song number -> catalog id, filled in as songs are first needed
+        self._catalogIds = np.full(nSongs, -1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _string(self, offset: int, length: int) -> Optional[str]:
+        if length == NO_STRING:
+            return None
+        start = self._stringOffset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def songFields(self, song: int) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """(title, artist, album) of a song number used in the records."""
+        fields = self._songTable[song].tolist()
+        return tuple(self._string(fields[i], fields[i + 1]) for i in (0, 2, 4))
+
+    def _toCatalogIds(self, songs: np.ndarray) -> np.ndarray:
+        """Intern only the songs referenced by these records."""
+        missing = np.unique(songs[self._catalogIds[songs] < 0])
+        for song in missing.tolist():
+            self._catalogIds[song] = CATALOG.internSong(*self.songFields(song)).id
+        return self._catalogIds[songs]
+
+    def getStations(self) -> List[str]:
+        return list(self.stations.keys())
+
+    def readStation(self, stationName: str, start: float = None, end: float = None) -> PlayColumns:
+        """Read one station's plays in [start, end) into PlayColumns. Timestamps are found by binary search."""
+        first, count = self.stations[stationName]
+        records = self.records[first:first + count]
+        timestamps = records['timestamp']
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        hi = count if end is None else int(np.searchsorted(timestamps, end, side='left'))
+        records = records[lo:hi]
+        stationIds = np.full(len(records), CATALOG.internStation(stationName), dtype=np.int16)
+        return PlayColumns(self._toCatalogIds(records['song'].astype(np.int64)), stationIds,
+                           records['timestamp'].copy())
+
+    def readStationList(self, stationName: str, start: float = None, end: float = None) -> SongList:
+        return SongList.fromColumns(self.readStation(stationName, start, end))
+
+
+def convertPickle(pickleFilename: str, snapshotFilename: str) -> None:
+    """Convert a pickled StationPlayCollection (the format in saved/) into a snapshot file."""
+    with open(pickleFilename, 'rb') as fp:
+        collection = pickle.load(fp)
+    writeSnapshot(snapshotFilename, dict((name, songList.columns) for name, songList in collection.getLists().items()))
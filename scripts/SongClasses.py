@@ -1,45 +1,546 @@
 import pickle
 import time
-from typing import List, Tuple, Union
+from typing import List, Tuple, Union, Dict, Optional, TYPE_CHECKING
 from datetime import datetime, timedelta
-from matplotlib import pyplot as plt
+import numpy as np
+import threading
 from collections import Counter
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure  # matplotlib itself is only imported when a chart is drawn
+
 
 """
 SongClasses
     This file contains classes which define the datatypes of PlayedSong (one song that was played on the radio) and
     SongList (an abstract list of PlayedSongs, ex. all the times 'Symphony' was played or all the songs played on Air1
-    within an interval of time).
+    within an interval of time). SongLists are stored as parallel NumPy columns (PlayColumns) of interned song ids,
+    station ids and timestamps, so that most analytics run as vectorized operations.
+
+    matplotlib is only imported by the first chart, so the collector never loads it.
 """
 
 
-class PlayedSong:
+class Song:
+    """One distinct song. Each (title, artist, album) is interned once in the SongCatalog, so Songs compare by id."""
 
-    def __init__(self, title, artist, album, stationName, timestamp=None):
+    __slots__ = ('id', 'title', 'artist', 'album')
+
+    def __init__(self, songId: int, title: str, artist: str, album: str):
+        self.id = songId
         self.title = title
         self.artist = artist
         self.album = album
-        self.stationName = stationName
+
+    def __reduce__(self):
+        return _internSong, (self.title, self.artist, self.album)
+
+    def __repr__(self):
+        return '<Song %d: %s>' % (self.id, self.title)
+
+
+class SongCatalog:
+    """Process-wide table that interns (title, artist, album) triples to Songs and station names to small integer ids."""
+
+    def __init__(self):
+        self.songs = []  # type: List[Song]
+        self.songIds = {}  # type: Dict[Tuple[str, str, str], Song]
+        self.stationNames = []  # type: List[str]
+        self.stationIds = {}  # type: Dict[str, int]
+        self.songsByTitle = {}  # type: Dict[str, List[Song]]
+        self.songsByArtist = {}  # type: Dict[str, List[Song]]
+        self._lock = threading.Lock()  # Only taken when a new entry is added (scrapers may run in threads)
+
+    def internSong(self, title: str, artist: str, album: str) -> Song:
+        key = (title, artist, album)
+        song = self.songIds.get(key)
+        if song is None:
+            with self._lock:
+                song = self.songIds.get(key)
+                if song is None:
+                    song = Song(len(self.songs), title, artist, album)
+                    self.songs.append(song)
+                    self.songsByTitle.setdefault(title, []).append(song)
+                    self.songsByArtist.setdefault(artist, []).append(song)
+                    self.songIds[key] = song
+        return song
+
+    def internStation(self, stationName: str) -> int:
+        stationId = self.stationIds.get(stationName)
+        if stationId is None:
+            with self._lock:
+                stationId = self.stationIds.get(stationName)
+                if stationId is None:
+                    stationId = len(self.stationNames)
+                    self.stationNames.append(stationName)
+                    self.stationIds[stationName] = stationId
+        return stationId
+
+    def findSongs(self, title: str = None, artist: str = None) -> np.ndarray:
+        """Return the ids of every interned song matching the given title and/or artist."""
+        if title is not None:
+            candidates = self.songsByTitle.get(title, [])
+        elif artist is not None:
+            candidates = self.songsByArtist.get(artist, [])
+        else:
+            candidates = self.songs
+        return np.array([song.id for song in candidates if artist is None or artist == song.artist], dtype=np.int32)
+
+
+CATALOG = SongCatalog()
+
+
+def _internSong(title: str, artist: str, album: str) -> Song:
+    return CATALOG.internSong(title, artist, album)
+
+
+def localTimeParts(timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized datetime.fromtimestamp(ts).hour and .weekday(), honoring the local UTC offset (and its DST changes)."""
+    if not len(timestamps):
+        return np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8)
+
+    # Local UTC offsets only change on hour boundaries, so look one up per distinct UTC hour
+    utcHours, inverse = np.unique(np.floor_divide(timestamps, 3600).astype(np.int64), return_inverse=True)
+    offsets = np.array([time.localtime(hour * 3600).tm_gmtoff for hour in utcHours.tolist()], dtype=np.float64)
+    localTimes = timestamps + offsets[inverse.reshape(-1)]
+    hours = (np.floor_divide(localTimes, 3600) % 24).astype(np.int8)
+    weekdays = ((np.floor_divide(localTimes, 86400) + 3) % 7).astype(np.int8)  # Jan 1 1970 was a Thursday
+    return hours, weekdays
+
+
+def _appendToArray(array: np.ndarray, n: int, values: np.ndarray) -> np.ndarray:
+    """Write values after the first n entries of array, growing it geometrically when it is full. Returns the array
+    to keep (a new one if it had to grow)."""
+    if n + len(values) > len(array):
+        grown = np.zeros(max(n + len(values), 2 * len(array), 16), dtype=array.dtype)
+        grown[:n] = array[:n]
+        array = grown
+    array[n:n + len(values)] = values
+    return array
+
+
+class PlayColumns:
+    """Growable parallel NumPy arrays holding the song id, station id and timestamp of every play."""
+
+    def __init__(self, songIds: np.ndarray = None, stationIds: np.ndarray = None, timestamps: np.ndarray = None):
+        self._songIds = np.zeros(0, dtype=np.int32) if songIds is None else np.asarray(songIds, dtype=np.int32)
+        self._stationIds = np.zeros(0, dtype=np.int16) if stationIds is None else np.asarray(stationIds, dtype=np.int16)
+        self._timestamps = np.zeros(0, dtype=np.float64) if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+        self.n = len(self._songIds)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def songIds(self) -> np.ndarray:
+        return self._songIds[:self.n]
+
+    @property
+    def stationIds(self) -> np.ndarray:
+        return self._stationIds[:self.n]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self.n]
+
+    def songKeys(self) -> np.ndarray:
+        """One int64 per play identifying the (song, station) pair, matching PlayedSong equality."""
+        return (self.stationIds.astype(np.int64) << 32) | self.songIds.astype(np.int64)
+
+    def append(self, songIds: np.ndarray, stationIds: np.ndarray, timestamps: np.ndarray) -> None:
+        # Arrays grow geometrically so that appending one poll at a time stays amortized O(1)
+        self._songIds = _appendToArray(self._songIds, self.n, songIds)
+        self._stationIds = _appendToArray(self._stationIds, self.n, stationIds)
+        self._timestamps = _appendToArray(self._timestamps, self.n, timestamps)
+        self.n += len(songIds)
+
+    def extend(self, other: 'PlayColumns') -> None:
+        self.append(other.songIds, other.stationIds, other.timestamps)
+
+    def __getstate__(self):
+        # Catalog ids are only meaningful inside one process, so pickle the strings they stand for
+        songIds, localSongIds = np.unique(self.songIds, return_inverse=True)
+        stationIds, localStationIds = np.unique(self.stationIds, return_inverse=True)
+        return {'songKeys': [(CATALOG.songs[songId].title, CATALOG.songs[songId].artist, CATALOG.songs[songId].album)
+                             for songId in songIds.tolist()],
+                'stationNames': [CATALOG.stationNames[stationId] for stationId in stationIds.tolist()],
+                'songIds': localSongIds.reshape(-1).astype(np.int32),
+                'stationIds': localStationIds.reshape(-1).astype(np.int16),
+                'timestamps': self.timestamps.copy()}
+
+    def __setstate__(self, state):
+        songIds = np.array([CATALOG.internSong(*key).id for key in state['songKeys']], dtype=np.int32)
+        stationIds = np.array([CATALOG.internStation(name) for name in state['stationNames']], dtype=np.int16)
+        self.__init__(songIds[state['songIds']], stationIds[state['stationIds']], state['timestamps'])
+
+    def frozen(self) -> 'PlayColumns':
+        """The plays stored so far, without copying them. Appends only ever write past the first n entries (or into a
+        new array), so the frozen columns keep their contents while these keep growing."""
+        return PlayColumns(self.songIds, self.stationIds, self.timestamps)
+
+    def take(self, positions: np.ndarray) -> 'PlayColumns':
+        return PlayColumns(self.songIds[positions], self.stationIds[positions], self.timestamps[positions])
+
+    def withoutDuplicates(self, minGap: float) -> Tuple['PlayColumns', int]:
+        """Sort the plays by time and drop every repeat of a song that comes less than minGap seconds after the last
+        play of it that was kept (stitching duplicates). Returns the cleaned columns and how many plays were dropped."""
+        keys = self.songKeys()
+        byKeyThenTime = np.lexsort((self.timestamps, keys))
+        sortedKeys = keys[byKeyThenTime]
+        sortedTimes = self.timestamps[byKeyThenTime]
+        # A play at least minGap after the song's previous play is kept. Runs of closer plays are walked one by one,
+        # measuring each from the last kept play, so a long run of repeats keeps one play every minGap.
+        duplicate = np.zeros(self.n, dtype=bool)
+        duplicate[1:] = (sortedKeys[1:] == sortedKeys[:-1]) & (np.diff(sortedTimes) < minGap)
+        lastKept, previous = 0.0, -2
+        for position in np.flatnonzero(duplicate).tolist():
+            if position != previous + 1:
+                lastKept = sortedTimes[position - 1]  # The play before the run was kept
+            if sortedTimes[position] - lastKept >= minGap:
+                duplicate[position] = False
+                lastKept = sortedTimes[position]
+            previous = position
+        kept = byKeyThenTime[~duplicate]
+        kept = kept[np.argsort(self.timestamps[kept], kind='stable')]
+        return self.take(kept), int(np.count_nonzero(duplicate))
+
+    def makePlayedSong(self, position: int) -> 'PlayedSong':
+        return PlayedSong.fromIds(CATALOG.songs[self._songIds[position]], int(self._stationIds[position]),
+                                  float(self._timestamps[position]))
+
+
+class TimeIndex:
+    """The local hour of day and day of week of every play in a SongList, computed as plays are appended, plus the
+    plays' positions in time order. Hour selections become bucket lookups and time ranges become binary searches."""
+
+    def __init__(self):
+        self.n = 0
+        self._hours = np.zeros(0, dtype=np.int8)
+        self._weekdays = np.zeros(0, dtype=np.int8)
+        self._timeOrder = np.zeros(0, dtype=np.int64)  # Positions sorted by timestamp
+        self._sortedTimes = np.zeros(0, dtype=np.float64)
+        self._timeOrderValid = True
+        self._hourBuckets = None  # type: Optional[Tuple[np.ndarray, np.ndarray]]  # (positions by hour, bucket starts)
+
+    @property
+    def hours(self) -> np.ndarray:
+        return self._hours[:self.n]
+
+    @property
+    def weekdays(self) -> np.ndarray:
+        return self._weekdays[:self.n]
+
+    def append(self, timestamps: np.ndarray, hours: np.ndarray = None, weekdays: np.ndarray = None) -> None:
+        if hours is None:
+            hours, weekdays = localTimeParts(timestamps)
+        self._hours = _appendToArray(self._hours, self.n, hours)
+        self._weekdays = _appendToArray(self._weekdays, self.n, weekdays)
+
+        # Plays usually arrive in time order, in which case the sorted order just grows; otherwise re-sort when needed
+        if self._timeOrderValid and len(timestamps):
+            inOrder = np.all(np.diff(timestamps) >= 0) and \
+                (self.n == 0 or timestamps[0] >= self._sortedTimes[self.n - 1])
+            if inOrder:
+                self._timeOrder = _appendToArray(self._timeOrder, self.n, np.arange(self.n, self.n + len(timestamps)))
+                self._sortedTimes = _appendToArray(self._sortedTimes, self.n, timestamps)
+            else:
+                self._timeOrderValid = False
+        self.n += len(timestamps)
+        self._hourBuckets = None
+
+    def _sortByTime(self, timestamps: np.ndarray) -> None:
+        if not self._timeOrderValid:
+            self._timeOrder = np.argsort(timestamps, kind='stable')
+            self._sortedTimes = timestamps[self._timeOrder]
+            self._timeOrderValid = True
+
+    def positionsInRange(self, timestamps: np.ndarray, start: float = None, end: float = None) -> np.ndarray:
+        """Positions (in list order) of the plays with start <= timestamp < end. timestamps is the list's column."""
+        self._sortByTime(timestamps)
+        sortedTimes = self._sortedTimes[:self.n]
+        lo = 0 if start is None else np.searchsorted(sortedTimes, start, side='left')
+        hi = self.n if end is None else np.searchsorted(sortedTimes, end, side='left')
+        return np.sort(self._timeOrder[lo:hi])
+
+    def positionsAtHours(self, hours: List[int]) -> np.ndarray:
+        """Positions (in list order) of the plays during any of the given hours of the day."""
+        if self._hourBuckets is None:
+            byHour = np.argsort(self.hours, kind='stable')
+            self._hourBuckets = byHour, np.searchsorted(self.hours[byHour], np.arange(25))
+        byHour, starts = self._hourBuckets
+        buckets = [byHour[starts[hour]:starts[hour + 1]] for hour in hours if 0 <= hour < 24]
+        if len(buckets) == 1:
+            return buckets[0]
+        return np.sort(np.concatenate(buckets)) if buckets else np.zeros(0, dtype=np.int64)
+
+    def hourCounts(self) -> np.ndarray:
+        """Number of plays during each of the 24 hours of the day."""
+        return np.bincount(self.hours, minlength=24)
+
+
+class SongIndex:
+    """Inverted index from song id to the positions of that song's plays in a SongList. It is built in one vectorized
+    pass the first time it is needed and then kept up to date as plays are appended, so per-song lookups cost time
+    proportional to the number of plays found rather than the length of the list."""
+
+    def __init__(self):
+        self._bySong = None  # type: Optional[np.ndarray]  # Positions sorted by song id, None until built
+        self._ranges = {}  # type: Dict[int, Tuple[int, int]]  # Song id -> slice of _bySong
+        self._pending = {}  # type: Dict[int, List[int]]  # Positions appended since the last build
+        self._nPending = 0
+
+    def append(self, start: int, songIds: np.ndarray) -> None:
+        if self._bySong is None:
+            return
+        for position, songId in enumerate(songIds.tolist(), start):
+            self._pending.setdefault(songId, []).append(position)
+        self._nPending += len(songIds)
+
+        # Fold large batches (ex. loading another list) into a rebuild rather than keeping them as Python lists
+        if self._nPending > max(4096, len(self._bySong) // 4):
+            self._bySong = None
+
+    def _build(self, songIds: np.ndarray) -> None:
+        self._bySong = np.argsort(songIds, kind='stable')
+        uniqueIds, starts = np.unique(songIds[self._bySong], return_index=True)
+        ends = np.append(starts[1:], len(songIds))
+        self._ranges = dict(zip(uniqueIds.tolist(), zip(starts.tolist(), ends.tolist())))
+        self._pending = {}
+        self._nPending = 0
+
+    def positionsOf(self, songIds: np.ndarray, columnSongIds: np.ndarray) -> np.ndarray:
+        """Positions (in list order) of every play of the given songs. columnSongIds is the list's song id column."""
+        if self._bySong is None:
+            self._build(columnSongIds)
+        found = []
+        for songId in np.asarray(songIds).tolist():
+            lo, hi = self._ranges.get(songId, (0, 0))
+            found.append(self._bySong[lo:hi])
+            if songId in self._pending:
+                found.append(np.array(self._pending[songId], dtype=np.int64))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(found)) if len(found) > 1 else found[0]
+
+
+class PlayStats:
+    """Running statistics of a SongList: plays per song, unique songs, total plays and, for order statistics over the
+    per-song play counts, how many songs have each play count. Built in one vectorized pass on first use and then
+    updated as plays are appended, so variety metrics cost next to nothing during collection."""
+
+    def __init__(self):
+        self.built = False
+        self.plays = Counter()  # type: Counter  # Song key (see PlayColumns.songKeys) -> plays
+        self.countOfCounts = Counter()  # type: Counter  # Play count -> number of songs played that many times
+        self.total = 0
+
+    def append(self, keys: np.ndarray) -> None:
+        if not self.built:
+            return
+        if len(keys) > 64:
+            uniqueKeys, counts = np.unique(keys, return_counts=True)
+            updates = zip(uniqueKeys.tolist(), counts.tolist())
+        else:
+            updates = ((key, 1) for key in keys.tolist())
+        for key, count in updates:
+            old = self.plays[key]
+            if old:
+                self.countOfCounts[old] -= 1
+                if not self.countOfCounts[old]:
+                    del self.countOfCounts[old]
+            self.plays[key] = old + count
+            self.countOfCounts[old + count] += 1
+        self.total += len(keys)
+
+    def build(self, keys: np.ndarray) -> None:
+        self.plays = Counter()
+        self.countOfCounts = Counter()
+        self.total = 0
+        self.built = True
+        self.append(keys)
+
+    @property
+    def unique(self) -> int:
+        return len(self.plays)
+
+    def uniquenessIndex(self) -> float:
+        return self.unique / self.total if self.total else 0.0
+
+    def _countsAscending(self):
+        """(play count, number of songs) pairs from least to most played."""
+        return sorted(self.countOfCounts.items())
+
+    def countAtRank(self, ranks: List[int]) -> List[int]:
+        """The play counts found at the given positions of the ascending list of per-song play counts."""
+        output = dict()
+        seen = 0
+        wanted = sorted(set(ranks))
+        for count, nSongs in self._countsAscending():
+            seen += nSongs
+            while wanted and wanted[0] < seen:
+                output[wanted.pop(0)] = count
+        return [output[rank] for rank in ranks]
+
+    def fiveNumberSummary(self) -> Tuple[int, int, int, int, int]:
+        """min, first quartile, median, third quartile and max of the per-song play counts."""
+        nVals = self.unique
+        return tuple(self.countAtRank([0, nVals // 4, nVals // 2, 3 * (nVals // 4), nVals - 1]))
+
+    def topShare(self, n: int = 10) -> float:
+        """Fraction of all plays that went to the n most played songs."""
+        plays = 0
+        for count, nSongs in reversed(self._countsAscending()):
+            taken = min(nSongs, n)
+            plays += taken * count
+            n -= taken
+            if not n:
+                break
+        return plays / self.total if self.total else 0.0
+
+
+def newFigure(filename: str = None) -> 'Figure':
+    """A figure to draw one chart on. Charts that are written to a file get a standalone Figure on the Agg canvas, so
+    rendering needs no display, never touches pyplot's global state and is safe in worker processes."""
+    if filename is None:
+        from matplotlib import pyplot as plt
+        return plt.figure()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def showOrSave(figure: 'Figure', filename: str = None) -> None:
+    """Show a figure from newFigure in a window, or write it to filename (format from the extension)."""
+    if filename is None:
+        from matplotlib import pyplot as plt
+        plt.show()
+    else:
+        figure.savefig(filename, bbox_inches='tight')
+
+
+BUFFER_BETWEEN_SONGS = 12 * 60  # 12 minutes is the max time between 1st song start and 2nd song start
+
+
+class CaptureIntervals:
+    """The [start, end] intervals of time a SongList covers: runs of plays less than BUFFER_BETWEEN_SONGS apart. Plays
+    appended in time order (as during collection) extend the intervals in place, so coverage queries are O(1). Anything
+    else marks them stale, and the next query rebuilds them from the timestamps with a NumPy diff-and-split."""
+
+    def __init__(self):
+        self.intervals = []  # type: List[List[int]]
+        self.length = 0  # Seconds covered by all intervals
+        self._lastTimestamp = None  # type: Optional[float]
+        self._valid = True
+
+    def append(self, timestamps: np.ndarray) -> None:
+        if not self._valid or not len(timestamps):
+            return
+        if len(timestamps) > 1024 or np.any(np.diff(timestamps) < 0) or \
+                (self._lastTimestamp is not None and timestamps[0] < self._lastTimestamp):
+            self._valid = False
+            return
+        for timestamp in timestamps.tolist():
+            # Continue the current interval if this play is within its acceptable addition buffer
+            if self.intervals and self.intervals[-1][1] + BUFFER_BETWEEN_SONGS > timestamp:
+                self.length += int(timestamp) - self.intervals[-1][1]
+                self.intervals[-1][1] = int(timestamp)
+            else:
+                self.intervals.append([int(timestamp), int(timestamp)])
+            self._lastTimestamp = timestamp
+
+    def rebuild(self, timestamps: np.ndarray) -> None:
+        timestamps = np.sort(timestamps)
+        self.intervals = []
+        self.length = 0
+        self._lastTimestamp = None
+        self._valid = True
+        if not len(timestamps):
+            return
+
+        # An interval ends wherever the next play is not within the buffer of the previous one
+        breaks = np.flatnonzero(np.floor(timestamps[:-1]) + BUFFER_BETWEEN_SONGS <= timestamps[1:])
+        starts = np.floor(timestamps[np.concatenate(([0], breaks + 1))]).astype(np.int64)
+        ends = np.floor(timestamps[np.concatenate((breaks, [len(timestamps) - 1]))]).astype(np.int64)
+        self.intervals = np.stack((starts, ends), axis=1).tolist()
+        self.length = int(np.sum(ends - starts))
+        self._lastTimestamp = float(timestamps[-1])
+
+    def getIntervals(self, timestamps: np.ndarray) -> List[List[int]]:
+        """The intervals, rebuilding them from the list's timestamp column if they are stale."""
+        if not self._valid:
+            self.rebuild(timestamps)
+        return [list(interval) for interval in self.intervals]
+
+    def getLength(self, timestamps: np.ndarray) -> int:
+        if not self._valid:
+            self.rebuild(timestamps)
+        return self.length
+
+
+class PlayedSong:
+    """One play of a Song on a station. Only the interned Song, the station id and the timestamp are stored. Songs
+    parsed without a play time are dated when they are scraped and marked as such."""
+
+    __slots__ = ('song', 'stationId', 'timestamp', 'scraped')
+
+    def __init__(self, title, artist, album, stationName, timestamp=None):
+        self.song = CATALOG.internSong(title, artist, album)
+        self.stationId = CATALOG.internStation(stationName)
         if timestamp:
             self.timestamp = timestamp
+            self.scraped = False
         else:
             self.timestamp = time.time()
+            self.scraped = True  # The station did not publish when it was played
+
+    @staticmethod
+    def fromIds(song: Song, stationId: int, timestamp: float) -> 'PlayedSong':
+        """Build a PlayedSong from already interned values without going through the catalog."""
+        obj = PlayedSong.__new__(PlayedSong)
+        obj.song = song
+        obj.stationId = stationId
+        obj.timestamp = timestamp
+        obj.scraped = False
+        return obj
+
+    @property
+    def title(self) -> str:
+        return self.song.title
+
+    @property
+    def artist(self) -> str:
+        return self.song.artist
+
+    @property
+    def album(self) -> str:
+        return self.song.album
+
+    @property
+    def stationName(self) -> str:
+        return CATALOG.stationNames[self.stationId]
+
+    def __reduce__(self):
+        return PlayedSong, (self.title, self.artist, self.album, self.stationName, self.timestamp)
+
+    def __setstate__(self, state):
+        # Collections pickled before PlayedSong used __slots__ store a plain attribute dict
+        self.song = CATALOG.internSong(state['title'], state['artist'], state['album'])
+        self.stationId = CATALOG.internStation(state['stationName'])
+        self.timestamp = state['timestamp']
+        self.scraped = False
 
     def isSameSong(self, other):
-        thisDict = self.__dict__.copy()
-        otherDict = other.__dict__.copy()
-        thisDict['timestamp'] = otherDict['timestamp'] = None
-        if thisDict == otherDict:
-            return True
-        else:
-            return False
+        return self.song is other.song and self.stationId == other.stationId
 
     def __eq__(self, other):
+        if not isinstance(other, PlayedSong):
+            return NotImplemented
         return self.isSameSong(other)
 
     def __hash__(self):
-        return hash(self.title + self.artist + self.album)
+        return self.song.id
 
     def __str__(self):
         return '<%s>' % self.title
@@ -59,12 +560,20 @@ class PlayedSong:
         return '[%s]' % ', '.join(strSongs)
 
 
+def hasPublishedTimes(songs: List[PlayedSong]) -> bool:
+    """Whether a fetched list carries play times published by the station, rather than the times it was scraped."""
+    return bool(songs) and not any(song.scraped for song in songs)
+
+
 class SongList:
 
     def __init__(self, songsToAdd: List[PlayedSong]=None):
-        self.currentSongIter = 0
-        self.songs = []  # type: List[PlayedSong]
-        self.n = 0
+        self.columns = PlayColumns()
+        self.timeIndex = TimeIndex()
+        self.songIndex = SongIndex()
+        self.captureIntervals = CaptureIntervals()
+        self._stats = PlayStats()
+        self._songs = []  # type: List[Optional[PlayedSong]]  # PlayedSong objects, None until materialized
         if songsToAdd is not None:
             self.add(songsToAdd)
 
@@ -74,6 +583,46 @@ class SongList:
         obj.addLists(songLists)
         return obj
 
+    @staticmethod
+    def fromColumns(columns: PlayColumns) -> 'SongList':
+        """Wrap columns directly. PlayedSong objects are only created when a caller asks for them."""
+        obj = SongList()
+        obj.addColumns(columns)
+        return obj
+
+    def __getstate__(self):
+        return self.columns.__getstate__()
+
+    def __setstate__(self, state):
+        columns = PlayColumns()
+        columns.__setstate__(state)
+        self.__init__()
+        self.addColumns(columns)
+
+    @property
+    def n(self) -> int:
+        return self.columns.n
+
+    @property
+    def songs(self) -> List[PlayedSong]:
+        self._materialize(0, self.n)
+        return self._songs
+
+    def _materialize(self, start: int, stop: int) -> None:
+        for i in range(start, stop):
+            if self._songs[i] is None:
+                self._songs[i] = self.columns.makePlayedSong(i)
+
+    def _songAt(self, position: int) -> PlayedSong:
+        self._materialize(position, position + 1)
+        return self._songs[position]
+
+    def tail(self, n: int) -> List[PlayedSong]:
+        """The last n PlayedSongs, materializing only those."""
+        start = max(self.n - n, 0)
+        self._materialize(start, self.n)
+        return self._songs[start:]
+
     def __repr__(self):
         return '<SongList of %d song%s>' % (self.n, '' if self.n == 1 else 's')
 
@@ -81,175 +630,146 @@ class SongList:
         return self.n
 
     def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.currentSongIter < self.n:
-            self.currentSongIter += 1
-            return self.songs[self.currentSongIter - 1]
-        raise StopIteration
-
-    def showTimeCoverage(self):
-        hours = [datetime.fromtimestamp(song.timestamp).hour for song in self.songs]
-        plt.hist(hours, 24)
-        plt.xlabel('Hour')
-        plt.ylabel('Frequency')
-        plt.show()
+        # A fresh iterator each time, so a list can be iterated any number of times (also concurrently)
+        for position in range(self.n):
+            yield self._songAt(position)
+
+    def showTimeCoverage(self, filename: str = None):
+        figure = newFigure(filename)
+        ax = figure.add_subplot(1, 1, 1)
+        ax.hist(self.timeIndex.hours, 24)
+        ax.set_xlabel('Hour')
+        ax.set_ylabel('Frequency')
+        showOrSave(figure, filename)
+
+    def _positionsOfSong(self, song: PlayedSong) -> np.ndarray:
+        """Positions of the plays equal to song (the same song on the same station)."""
+        positions = self.songIndex.positionsOf([song.song.id], self.columns.songIds)
+        return positions[self.columns.stationIds[positions] == song.stationId]
 
     def timesPlayed(self, song: PlayedSong) -> int:
-        return self.songs.count(song)
+        return len(self._positionsOfSong(song))
 
-    def showWhenPlayed(self, byHour: bool=False, byHourAndDay: bool=False, song: PlayedSong=None, title: str=None, artist: str=None):
+    def showWhenPlayed(self, byHour: bool=False, byHourAndDay: bool=False, song: PlayedSong=None, title: str=None, artist: str=None,
+                       filename: str = None):
         # Error checking
         if not (byHour ^ byHourAndDay):
             raise RuntimeError('Need either byHour or byHourAndDay selected')
 
         # Get data
         if song:
-            timestamps = [int(eachSong.timestamp) for eachSong in self.songs if eachSong == song]
+            timestamps = self.columns.timestamps[self._positionsOfSong(song)].astype(int).tolist()
         elif title or artist:
-            timestamps = [int(eachSong.timestamp) for eachSong in self.select(title=title, artist=artist)]
+            timestamps = self.where(title=title, artist=artist).timestamps().astype(int).tolist()
         else:
             raise RuntimeError('Argument error: pass song object or title and artist data to this function')
 
         # By hour and day
         if byHourAndDay:
-            self._graphTimestampsByTimeOfDay(points=timestamps)
+            self._graphTimestampsByTimeOfDay(points=timestamps, filename=filename)
 
         # By hour
         else:
-            adjustedPts = []
-            points = Counter([datetime.fromtimestamp(timestamp).hour for timestamp in timestamps])
-            for hour in range(24):
-                adjustedPts.append(points[hour] / len(self.select(hours=hour)))  # Adjust for lack of coverage for some hours
-
-            plt.bar(range(24), adjustedPts)
-            plt.xlabel('Hour')
-            plt.ylabel('Frequency')
-            plt.title('When is "%s" played?' % (song.title if song else title))
-            plt.show()
+            points = np.bincount(localTimeParts(np.array(timestamps, dtype=np.float64))[0], minlength=24)
+            coverage = self.timeIndex.hourCounts()
+            adjustedPts = np.divide(points, coverage, out=np.zeros(24), where=coverage > 0)  # Adjust for lack of coverage for some hours
+
+            figure = newFigure(filename)
+            ax = figure.add_subplot(1, 1, 1)
+            ax.bar(range(24), adjustedPts)
+            ax.set_xlabel('Hour')
+            ax.set_ylabel('Frequency')
+            ax.set_title('When is "%s" played?' % (song.title if song else title))
+            showOrSave(figure, filename)
 
     def getCaptureIntervals(self) -> List[List[int]]:
-        BUFFER_BETWEEN_SONGS = 12 * 60  # 12 minutes is the max time between 1st song start and 2nd song start
-
-        # Our timestamps of all the songs in this list sorted in ascending order
-        timestamps = sorted([song.timestamp for song in self.songs])  # type: List[float]
-
-        intervals = []  # type: List[List[int, int]]
-        currentInterval = []
-        for i in range(len(timestamps)-1):
-            # If a new interval is starting
-            if not currentInterval:
-                currentInterval = [int(timestamps[i]), int(timestamps[i])]  # At the beginning, start and end are the same
-            # If an interval has been started and this timestamp is close to its current end
-            elif currentInterval[1] + BUFFER_BETWEEN_SONGS > timestamps[i]:  # If the interval's acceptable addition buffer includes this point
-                currentInterval[1] = int(timestamps[i])  # Add it to the interval
-            # If we need to start a new interval
-            else:
-                intervals.append(currentInterval)
-                currentInterval = []
-        intervals.append(currentInterval)
-        intervals = [inv for inv in intervals if inv]
-
-        return intervals
+        return self.captureIntervals.getIntervals(self.columns.timestamps)
 
-    def showFrequencyGraph(self, title: str = None, xMax: int = None, yMax: int = None, show=True, absolute=False):
+    def showFrequencyGraph(self, title: str = None, xMax: int = None, yMax: int = None, show=True, absolute=False,
+                           filename: str = None):
         """Graph frequency vs. song popularity for this song list."""
-        songsByPopularity = self.getPopularityIndices()
+        _, _, counts = self._uniqueSongCounts()
         if absolute:
             scale = self.n
         else:
             scale = 1
-        yVals = sorted([item[1]*scale for item in songsByPopularity], reverse=True)
-        xVals = range(1, len(self.getUniqueSongs()) + 1)
+        yVals = (np.sort(counts)[::-1] / self.n * scale).tolist()
+        xVals = range(1, len(counts) + 1)
 
         if show:
-            if xMax: plt.xlim(1, xMax)
-            if yMax: plt.ylim(1, yMax)
-            plt.plot(xVals, yVals)
+            figure = newFigure(filename)
+            ax = figure.add_subplot(1, 1, 1)
+            if xMax: ax.set_xlim(1, xMax)
+            if yMax: ax.set_ylim(1, yMax)
+            ax.plot(xVals, yVals)
             if title is None: title = 'Frequency graph of each song played in this list sorted by popularity'
             title += ' (n = %d)' % len(xVals)
-            plt.title(title)
-            plt.ylabel('Number of plays')
-            plt.xlabel('Songs sorted by most popular to least popular')
-            plt.show()
+            ax.set_title(title)
+            ax.set_ylabel('Number of plays')
+            ax.set_xlabel('Songs sorted by most popular to least popular')
+            showOrSave(figure, filename)
 
         return xVals, yVals
 
     @staticmethod
     def compareSongFrequencies(stationNames: List[str], *songLists: 'SongList',
-                               xMax: int = None, yMax: int = None, title: str = None):
-        if len(songLists) > 4:
-            raise RuntimeError('Cannot compare this list to more than 4 other song lists')
+                               xMax: int = None, yMax: int = None, title: str = None, filename: str = None):
         if len(songLists) < 2:
             raise RuntimeError('Need at least 2 song lists to compare their frequencies')
 
-        plt.ylabel('Number of plays')
-        if yMax: plt.ylim(1, yMax)
-        plt.xlabel('Songs sorted by most popular to least popular')
-        if xMax: plt.xlim(1, xMax)
-        if title: plt.title(title)
-
-        # Graph lines on same axes
-        colors = ['r', 'g', 'b', 'y']
-        i = 0
-        for i, otherList in enumerate(songLists):
-            plt.plot(*otherList.showFrequencyGraph(show=False), color=colors[i])
-
-        # Setup legend with matching colors
-        plt.legend(stationNames)
-        ax = plt.gca()
-        leg = ax.get_legend()
-        for j in range(i):
-            leg.legendHandles[j].set_color(colors[j])
+        figure = newFigure(filename)
+        ax = figure.add_subplot(1, 1, 1)
+        ax.set_ylabel('Number of plays')
+        if yMax: ax.set_ylim(1, yMax)
+        ax.set_xlabel('Songs sorted by most popular to least popular')
+        if xMax: ax.set_xlim(1, xMax)
+        if title: ax.set_title(title)
 
-        plt.show()
+        # Graph lines on same axes, colored by the color cycle so any number of stations can be compared
+        for otherList in songLists:
+            ax.plot(*otherList.showFrequencyGraph(show=False))
+        ax.legend(stationNames)
+
+        showOrSave(figure, filename)
 
     @staticmethod
-    def _showBoxAndWhisker(fiveNumberSummary: List[float], xlabel: str = None, ylabel: str = None):
-        """Show a box-and-whisker plot using pyplot"""
+    def _showBoxAndWhisker(fiveNumberSummary: List[float], xlabel: str = None, ylabel: str = None,
+                           filename: str = None):
+        """Show a box-and-whisker plot (or write it to filename)"""
 
         minVal, firstQ, median, thirdQ, maxVal = fiveNumberSummary
 
-        plt.xlim(1, maxVal + 10)
-        plt.ylim(0, 5)
+        figure = newFigure(filename)
+        ax = figure.add_subplot(1, 1, 1)
+        ax.set_xlim(1, maxVal + 10)
+        ax.set_ylim(0, 5)
 
-        plt.vlines([firstQ, thirdQ], 2, 3, colors='b', lw=4)
-        plt.vlines(median, 2, 3, lw=4, linestyles='dashed', colors='b')
+        ax.vlines([firstQ, thirdQ], 2, 3, colors='b', lw=4)
+        ax.vlines(median, 2, 3, lw=4, linestyles='dashed', colors='b')
 
-        plt.hlines([2, 3], firstQ, thirdQ, colors='b', lw=4)
-        plt.hlines(2.5, minVal, firstQ, colors='b', lw=4)
-        plt.hlines(2.5, thirdQ, maxVal, colors='b', lw=4)
+        ax.hlines([2, 3], firstQ, thirdQ, colors='b', lw=4)
+        ax.hlines(2.5, minVal, firstQ, colors='b', lw=4)
+        ax.hlines(2.5, thirdQ, maxVal, colors='b', lw=4)
 
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
 
-        plt.show()
+        showOrSave(figure, filename)
+
+    @property
+    def stats(self) -> PlayStats:
+        """Running play statistics of this list (built on first use, then kept up to date as plays are added)."""
+        if not self._stats.built:
+            self._stats.build(self.columns.songKeys())
+        return self._stats
 
-    def showFrequencyBoxAndWhisker(self, show=True):
-        songsByPopularity = self.getPopularityIndices()
-        vals = sorted([item[1] * self.n for item in songsByPopularity], reverse=False)
-        nVals = len(vals)
-        firstQ = vals[nVals // 4]
-        median = vals[nVals // 2]
-        thirdQ = vals[3 * (nVals // 4)]
-        maxVal = vals[-1]
-        minVal = vals[0]
+    def showFrequencyBoxAndWhisker(self, show=True, filename: str = None):
+        minVal, firstQ, median, thirdQ, maxVal = self.stats.fiveNumberSummary()
 
         if show:
             print('Five number summary: %d %d %d %d %d' % (minVal, firstQ, median, thirdQ, maxVal))
-
-            plt.xlim(1, maxVal + 10)
-            plt.ylim(0, 5)
-
-            plt.vlines([firstQ, thirdQ], 2, 3, colors='b', lw=4)
-            plt.vlines(median, 2, 3, lw=4, linestyles='dashed', colors='b')
-
-            plt.hlines([2, 3], firstQ, thirdQ, colors='b', lw=4)
-            plt.hlines(2.5, minVal, firstQ, colors='b', lw=4)
-            plt.hlines(2.5, thirdQ, maxVal, colors='b', lw=4)
-
-            plt.show()
+            self._showBoxAndWhisker([minVal, firstQ, median, thirdQ, maxVal], xlabel='Plays per song',
+                                    filename=filename)
 
         return minVal, firstQ, median, thirdQ, maxVal
 
@@ -267,7 +787,7 @@ class SongList:
         return timeElapsedSeconds
 
     def getSongTimestamps(self):
-        return [song.timestamp for song in self.songs]
+        return self.columns.timestamps.tolist()
 
     @staticmethod
     def _daysBetweenDates(date1: datetime, date2: datetime) -> int:
@@ -277,7 +797,7 @@ class SongList:
         return (B - A).days
 
     @staticmethod
-    def _graphTimestampsByTimeOfDay(intervals: List[List[int]] = None, points: List[int] = None):
+    def _graphTimestampsByTimeOfDay(intervals: List[List[int]] = None, points: List[int] = None, filename: str = None):
         # Error checks
         if not ((intervals is None) ^ (points is None)):
             raise RuntimeError('Need to input either a list of points or a list of intervals')
@@ -288,11 +808,15 @@ class SongList:
         if (intervals is not None) and (len(intervals) < 1):
             raise RuntimeError('Need at least one interval to graph')
 
+        figure = newFigure(filename)
+        ax = figure.add_subplot(1, 1, 1)
+
         # Setup X axis
-        plt.xlim(1, 25)
+        ax.set_xlim(1, 25)
         hourLabels = ["%d %s" % (hour if hour < 13 else (hour - 12), "AM" if hour < 13 else "PM") for hour in range(1, 25)]
-        plt.xticks(range(1,25), hourLabels, rotation=90)
-        plt.xlabel('Hour', fontsize='large')
+        ax.set_xticks(range(1,25))
+        ax.set_xticklabels(hourLabels, rotation=90)
+        ax.set_xlabel('Hour', fontsize='large')
 
         # Setup Y axis
         startDay = datetime.fromtimestamp(intervals[0][0]) if intervals is not None else datetime.fromtimestamp(points[0])
@@ -303,21 +827,22 @@ class SongList:
         for i in range(nDays+1):
             thisDayName = (startDay + timedelta(days=i)).strftime('%b %d')
             dayNames.append(thisDayName)
-        plt.yticks(range(nDays+1), dayNames[::-1])
-        plt.ylabel('Day', fontsize='large')
+        ax.set_yticks(range(nDays+1))
+        ax.set_yticklabels(dayNames[::-1])
+        ax.set_ylabel('Day', fontsize='large')
 
         # Drawing functions
         def drawInterval(startCoord: Tuple[float, float], endCoord: Tuple[float, float]):
             # If interval spans just one day
             if startCoord[1] == endCoord[1]:
-                plt.hlines(startCoord[1], startCoord[0], endCoord[0], lw=5, colors='b')
+                ax.hlines(startCoord[1], startCoord[0], endCoord[0], lw=5, colors='b')
 
             # If interval spans multiple days
             else:
                 drawInterval(startCoord, (24.0, startCoord[1]))  # Draw line across graph to the end of the line
                 drawInterval((1, startCoord[1] - 1), endCoord)
         def drawPoint(coord: Tuple[float, float]):
-            plt.scatter(coord[0], coord[1], marker='o', c='b', s=30)
+            ax.scatter(coord[0], coord[1], marker='o', c='b', s=30)
 
         # Convert to coord system
         if intervals is not None:
@@ -335,53 +860,203 @@ class SongList:
 
         # Show
         title = 'Intervals of time this song list contains' if points is None else 'The play times of songs in this list'
-        plt.title(title, fontsize='large')
-        plt.ioff()
-        plt.show()
+        ax.set_title(title, fontsize='large')
+        showOrSave(figure, filename)
 
-    def showCaptureIntervals(self):
+    def showCaptureIntervals(self, filename: str = None):
         ints = self.getCaptureIntervals()
-        self._graphTimestampsByTimeOfDay(intervals=ints)
+        self._graphTimestampsByTimeOfDay(intervals=ints, filename=filename)
 
     def getCaptureLength(self) -> int:
-        ints = self.getCaptureIntervals()
-        return self._timeElapsedAcrossIntervals(ints)
+        return self.captureIntervals.getLength(self.columns.timestamps)
 
     def select(self, title: str=None, artist: str=None, hours: Union[int, List[int]]=None):
-        if type(hours) == int:
-            hours = [hours]
-        return SongList([song for song in self.songs if
-                (title is None or title == song.title) and
-                (artist is None or artist == song.artist) and
-                (hours is None or datetime.fromtimestamp(song.timestamp).hour in hours)])
+        return self.where(title=title, artist=artist, hours=hours).toList()
+
+    def where(self, **filters) -> 'SongListView':
+        """A lazy view of the plays matching the filters (see SongListView.where). Nothing is evaluated until a terminal
+        operation such as count(), top() or timestamps() is called."""
+        return SongListView(self).where(**filters)
+
+    def selectRange(self, start: float = None, end: float = None) -> 'SongList':
+        """The plays with start <= timestamp < end, found by binary search over the time index."""
+        return self._take(self.timeIndex.positionsInRange(self.columns.timestamps, start, end))
+
+    def _take(self, positions: np.ndarray) -> 'SongList':
+        """A new SongList of the plays at the given positions, sharing any PlayedSongs already materialized."""
+        obj = SongList()
+        obj.columns = self.columns.take(positions)
+        obj.timeIndex.append(obj.columns.timestamps, self.timeIndex.hours[positions], self.timeIndex.weekdays[positions])
+        obj.captureIntervals.append(obj.columns.timestamps)
+        obj._songs = [self._songs[i] for i in positions.tolist()]
+        return obj
+
+    def _uniqueSongCounts(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The distinct songs of this list as (keys, position of first play, play count), most played first."""
+        keys, firstPositions, counts = np.unique(self.columns.songKeys(), return_index=True, return_counts=True)
+        order = np.lexsort((firstPositions, -counts))
+        return keys[order], firstPositions[order], counts[order]
 
     def getUniqueSongs(self) -> List[PlayedSong]:
-        return list(set(self.songs))
+        _, firstPositions, _ = self._uniqueSongCounts()
+        return [self._songAt(position) for position in firstPositions.tolist()]
 
     def getUniquenessIndex(self):
-        return len(self.getUniqueSongs()) / self.n
+        return self.stats.unique / self.n
 
     def getMostPopular(self, n: int=10):
         if n == 0:
             n = self.n
-        indices = self.getPopularityIndices()[:n]
-        return [index[0] for index in sorted(indices, reverse=True, key=lambda x:x[1])]
+        _, firstPositions, _ = self._uniqueSongCounts()
+        return [self._songAt(position) for position in firstPositions[:n].tolist()]
 
     def add(self, songs: List[PlayedSong]):
-        self.songs += [song for song in songs if song is not None]
-        self.n += len(songs)
+        songs = [song for song in songs if song is not None]
+        songIds = np.fromiter((song.song.id for song in songs), dtype=np.int32, count=len(songs))
+        stationIds = np.fromiter((song.stationId for song in songs), dtype=np.int16, count=len(songs))
+        timestamps = np.fromiter((song.timestamp for song in songs), dtype=np.float64, count=len(songs))
+        self.songIndex.append(self.n, songIds)
+        self._stats.append((stationIds.astype(np.int64) << 32) | songIds)
+        self.columns.append(songIds, stationIds, timestamps)
+        self.timeIndex.append(timestamps)
+        self.captureIntervals.append(timestamps)
+        self._songs += songs
+
+    def addColumns(self, columns: PlayColumns):
+        self.songIndex.append(self.n, columns.songIds)
+        self._stats.append(columns.songKeys())
+        self.columns.extend(columns)
+        self.timeIndex.append(columns.timestamps)
+        self.captureIntervals.append(columns.timestamps)
+        self._songs += [None] * len(columns)
 
     def addLists(self, songLists: List['SongList']):
         for songList in songLists:
-            self.add(songList.songs)
+            self.songIndex.append(self.n, songList.columns.songIds)
+            self._stats.append(songList.columns.songKeys())
+            self.captureIntervals.append(songList.columns.timestamps)
+            self.columns.extend(songList.columns)
+            self.timeIndex.append(songList.columns.timestamps, songList.timeIndex.hours, songList.timeIndex.weekdays)
+            self._songs += songList._songs
 
     def getPopularityIndices(self) -> List[Tuple[PlayedSong, float]]:
-        uniqueSongs = self.getUniqueSongs()
-        output = []
-        for unique in uniqueSongs:
-            output.append((unique, self.songs.count(unique) / self.n))
-        output.sort(key=lambda index: index[1], reverse=True)
-        return output
+        _, firstPositions, counts = self._uniqueSongCounts()
+        return [(self._songAt(position), count / self.n) for position, count in
+                zip(firstPositions.tolist(), counts.tolist())]
 
     def getHoursAndSongs(self) -> List[Tuple[int, 'SongList']]:
-        return [(hour, self.select(hour=hour)) for hour in range(24)]
+        return [(hour, self.select(hours=hour)) for hour in range(24)]
+
+
+
+_NO_MATCH = object()  # Filter value for contradictory filters (ex. two different titles)
+
+
+class SongListView:
+    """A lazy selection from a SongList. Chained where() calls only combine their filters. When a terminal operation
+    needs the result, the filter with an index behind it (song, time range, hour) picks the candidate plays and the
+    other filters are applied to those candidates only. Views can be iterated any number of times."""
+
+    def __init__(self, base: SongList, filters: Dict[str, object] = None):
+        self.base = base
+        self.filters = filters or {}
+        self._positions = None  # type: Optional[np.ndarray]
+        self._positionsFor = -1  # Length of the base list when _positions was computed
+
+    def __repr__(self):
+        return '<SongListView of %r where %s>' % (self.base, ', '.join('%s=%r' % item for item in self.filters.items()))
+
+    def where(self, title: str = None, artist: str = None, hours: Union[int, List[int]] = None,
+              weekdays: Union[int, List[int]] = None, stations: Union[str, List[str]] = None,
+              start: float = None, end: float = None) -> 'SongListView':
+        """A new view that also requires the given title, artist, local hours of day, weekdays (0 is Monday),
+        stations and/or time range [start, end)."""
+        filters = dict(self.filters)
+        for name, value in (('title', title), ('artist', artist)):
+            if value is not None:
+                # Two different titles (or artists) can never both match
+                filters[name] = value if filters.get(name, value) == value else _NO_MATCH
+        for name, value in (('hours', hours), ('weekdays', weekdays), ('stations', stations)):
+            if value is not None:
+                value = set([value] if isinstance(value, (int, str)) else value)
+                filters[name] = filters[name] & value if name in filters else value
+        if start is not None:
+            filters['start'] = max(start, filters.get('start', start))
+        if end is not None:
+            filters['end'] = min(end, filters.get('end', end))
+        return SongListView(self.base, filters)
+
+    def positions(self) -> np.ndarray:
+        """Evaluate the filters, returning the positions of the matching plays in the base list (in list order)."""
+        if self._positionsFor != self.base.n:
+            self._positions = self._evaluate()
+            self._positionsFor = self.base.n
+        return self._positions
+
+    def _evaluate(self) -> np.ndarray:
+        base, filters = self.base, self.filters
+        hasTime = 'start' in filters or 'end' in filters
+        if _NO_MATCH in (filters.get('title'), filters.get('artist')):
+            return np.zeros(0, dtype=np.int64)
+
+        # Candidates from the most selective index available
+        if 'title' in filters or 'artist' in filters:
+            songIds = CATALOG.findSongs(filters.get('title'), filters.get('artist'))
+            positions = base.songIndex.positionsOf(songIds, base.columns.songIds)
+        elif hasTime:
+            positions = base.timeIndex.positionsInRange(base.columns.timestamps, filters.get('start'), filters.get('end'))
+            hasTime = False
+        elif 'hours' in filters:
+            positions = base.timeIndex.positionsAtHours(sorted(filters['hours']))
+        else:
+            positions = np.arange(base.n)
+
+        # Remaining filters only look at the candidates
+        if hasTime:
+            timestamps = base.columns.timestamps[positions]
+            keep = np.ones(len(positions), dtype=bool)
+            if 'start' in filters:
+                keep &= timestamps >= filters['start']
+            if 'end' in filters:
+                keep &= timestamps < filters['end']
+            positions = positions[keep]
+        if 'hours' in filters:
+            positions = positions[np.isin(base.timeIndex.hours[positions], list(filters['hours']))]
+        if 'weekdays' in filters:
+            positions = positions[np.isin(base.timeIndex.weekdays[positions], list(filters['weekdays']))]
+        if 'stations' in filters:
+            stationIds = [CATALOG.stationIds[name] for name in filters['stations'] if name in CATALOG.stationIds]
+            positions = positions[np.isin(base.columns.stationIds[positions], stationIds)]
+        return positions
+
+    # Terminal operations
+
+    def count(self) -> int:
+        return len(self.positions())
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        for position in self.positions().tolist():
+            yield self.base._songAt(position)
+
+    def timestamps(self) -> np.ndarray:
+        return self.base.columns.timestamps[self.positions()]
+
+    def hourCounts(self) -> np.ndarray:
+        """Number of matching plays during each of the 24 hours of the day."""
+        return np.bincount(self.base.timeIndex.hours[self.positions()], minlength=24)
+
+    def top(self, n: int = 10) -> List[Tuple[PlayedSong, int]]:
+        """The n most played songs among the matching plays, with their play counts."""
+        positions = self.positions()
+        keys = self.base.columns.songKeys()[positions]
+        _, firstPositions, counts = np.unique(keys, return_index=True, return_counts=True)
+        order = np.lexsort((firstPositions, -counts))[:n]
+        return [(self.base._songAt(position), count) for position, count in
+                zip(positions[firstPositions[order]].tolist(), counts[order].tolist())]
+
+    def toList(self) -> SongList:
+        """Materialize the matching plays as a new SongList."""
+        return self.base._take(self.positions())
@@ -1,77 +1,226 @@
 from scripts.StationInterfaces import *
+from scripts.StationRegistry import StationRegistry, defaultRegistry
+from scripts.PlayLog import PlayLog
+from scripts.PollScheduler import PollScheduler
+from scripts.Stitching import stitchSongs, StitchResult
+from scripts.Snapshots import Snapshot, writeSnapshot, isSnapshot, replaceAtomically
+from scripts.StationComparison import StationSongMatrix
+from scripts.SnapshotChain import SnapshotChain, isChain
+from scripts.Metrics import METRICS
 from typing import List, Dict, Optional
-import os, time
+import os, queue, threading, time
 
 """
 SongCollection
     This file contains classes and functions that collect PlayedSongs into a format that can be analyzed and graphed.
 """
 
+STITCH_TAIL = 20  # Stored plays that a fetched list is aligned against
+MIN_PLAY_GAP = 30 * 60  # A station replaying a song sooner than this is a stitching duplicate
+
+
 class StationPlayCollection:
 
-    def __init__(self):
+    def __init__(self, log: PlayLog = None):
         self.songLists = {}
+        self.log = log  # Optional append-only log that receives every accepted play
+        self._snapshot = None  # type: Optional[Snapshot]  # Stations not in songLists yet are read from here
+        self._snapshotRange = (None, None)
+        self.lastStitch = {}  # type: Dict[str, StitchResult]  # Most recent merge for each station
 
     def __getstate__(self):
-        return {'stationData': dict([(item[0], item[1].songs) for item in self.songLists.items()])}
+        self._loadAll()
+        return {'stationColumns': dict((name, songList.columns) for name, songList in self.songLists.items())}
 
     def __setstate__(self, state):
         self.songLists = {}
-        for stationName in state['stationData']:
+        self.log = None
+        self._snapshot = None
+        self._snapshotRange = (None, None)
+        self.lastStitch = {}
+        for stationName, columns in state.get('stationColumns', {}).items():
+            self.songLists[stationName] = SongList.fromColumns(columns)
+        # Older collections were pickled as a list of PlayedSongs per station
+        for stationName in state.get('stationData', {}):
             self.songLists[stationName] = SongList(state['stationData'][stationName])
 
     def __getitem__(self, item: str) -> SongList:
+        self._loadStation(item)
         return self.songLists[item]
 
     def __setitem__(self, key: str, value: SongList):
         self.songLists[key] = value
 
-    def add(self, stationName, songs: List[PlayedSong]) -> None:
+    def add(self, stationName, songs: List[PlayedSong]) -> List[PlayedSong]:
+        """Stitch a station's recently played list onto its collection and return the songs that were accepted."""
+        self._loadStation(stationName)
+        storedSongs = self.songLists.get(stationName, None)
+        with METRICS.timer('stitch_seconds', station=stationName):
+            lastFewSongs = [] if storedSongs is None else storedSongs.tail(max(2 * len(songs), STITCH_TAIL))
+            stitch = stitchSongs(lastFewSongs, songs)
+        return self.addStitched(stationName, stitch)
+
+    def addStitched(self, stationName, stitch: StitchResult) -> List[PlayedSong]:
+        """Store the new plays of a fetch that was already stitched onto this station's latest plays (by a collector
+        worker, see ShardedCollector) and return them."""
         # Add first addition
+        self._loadStation(stationName)
         if self.songLists.get(stationName, None) is None:
-            print('[%s] Starting collection with %d song%s' % (stationName, len(songs), '' if len(songs) == 1 else 's'))
-            self.songLists[stationName] = SongList(songs)
+            print('[%s] Starting collection with %d song%s' % (stationName, len(stitch.newSongs),
+                                                               '' if len(stitch.newSongs) == 1 else 's'))
+            self.songLists[stationName] = SongList(stitch.newSongs)
 
         # Add to collection if not first addition
         else:
-            lastFewSongs = self.songLists[stationName].songs[-11:]
-            newSongs = getNewSongs(lastFewSongs, songs)
-            print('[%s] Adding %d new song%s' % (stationName, len(newSongs), '' if len(newSongs) == 1 else 's'))
-            self.songLists[stationName].add(newSongs)
+            if stitch.gap:
+                print('[-] No overlap between songs!')
+                METRICS.inc('stitch_gaps_total', station=stationName)
+            print('[%s] Adding %d new song%s (confidence %.2f)' %
+                  (stationName, len(stitch.newSongs), '' if len(stitch.newSongs) == 1 else 's', stitch.confidence))
+            self.songLists[stationName].add(stitch.newSongs)
+
+        self.lastStitch[stationName] = stitch
+        METRICS.inc('plays_added_total', len(stitch.newSongs), station=stationName)
+        METRICS.set('stitch_confidence', stitch.confidence, station=stationName)
+        if self.log is not None:
+            with METRICS.timer('log_append_seconds', station=stationName):
+                self.log.append(stitch.newSongs)
+        return stitch.newSongs
+
+    def attachLog(self, log: PlayLog) -> None:
+        """Send every play accepted from now on to a PlayLog. An empty log is first seeded with the current history."""
+        if not len(log):
+            self._loadAll()
+            for songList in self.songLists.values():
+                log.appendColumns(songList.columns)
+        self.log = log
 
-    def save(self, timestamp: Optional[int]=None, folder: Optional[str]=None):
+    @staticmethod
+    def fromLog(log: PlayLog) -> 'StationPlayCollection':
+        """Restore a collection from a PlayLog and keep appending to it."""
+        collection = StationPlayCollection(log)
+        for stationName, columns in log.readStations().items():
+            collection.songLists[stationName] = SongList.fromColumns(columns)
+        return collection
+
+    def save(self, timestamp: Optional[int]=None, folder: Optional[str]=None, snapshot: bool=False):
+        """Save the collection as a pickle, or as a memory-mappable snapshot file if snapshot is set."""
         if folder is None:
             folder = 'data'
         os.makedirs(folder, exist_ok=True)
         if timestamp is None:
             timestamp = int(time.time())
-        with open(os.path.join(folder, str(timestamp)), 'wb+') as fp:
+        filepath = os.path.join(folder, str(timestamp))
+        with METRICS.timer('save_seconds', format='snapshot' if snapshot else 'pickle'):
+            if snapshot:
+                self._loadAll()
+                replaceAtomically(filepath, lambda path: writeSnapshot(
+                    path, dict((name, songList.columns) for name, songList in self.songLists.items())))
+            else:
+                replaceAtomically(filepath, lambda path: self._pickle(path))
+
+    def _pickle(self, filepath: str) -> None:
+        with open(filepath, 'wb') as fp:
             pickle.dump(self, fp)
 
+    @staticmethod
+    def _pickleColumns(filepath: str, stations: Dict[str, PlayColumns]) -> None:
+        """Pickle columns as a collection of the stations, without building a SongList for each."""
+        with open(filepath, 'wb') as fp:
+            pickle.dump(_PickledCollection(stations), fp)
+
+    def _loadStation(self, stationName: str) -> None:
+        """Read a station from the snapshot this collection was restored from, the first time it is used."""
+        if self._snapshot is not None and stationName not in self.songLists and stationName in self._snapshot.stations:
+            self.songLists[stationName] = self._snapshot.readStationList(stationName, *self._snapshotRange)
+
+    def _loadAll(self) -> None:
+        if self._snapshot is not None:
+            for stationName in self._snapshot.getStations():
+                self._loadStation(stationName)
+
+    def removeDuplicates(self, minGap: float = MIN_PLAY_GAP) -> Tuple['StationPlayCollection', Dict[str, int]]:
+        """Return a cleaned copy of this collection, with each station sorted by time and with repeats of a song less
+        than minGap seconds apart dropped, along with the number of plays removed from each station."""
+        cleaned = StationPlayCollection()
+        removed = {}
+        for stationName in self.getStations():
+            columns, removed[stationName] = self[stationName].columns.withoutDuplicates(minGap)
+            cleaned[stationName] = SongList.fromColumns(columns)
+        return cleaned, removed
+
     def getStations(self) -> List[str]:
-        return list(self.songLists.keys())
+        stations = list(self.songLists.keys())
+        if self._snapshot is not None:
+            stations += [name for name in self._snapshot.getStations() if name not in self.songLists]
+        return stations
 
     def getAllSongs(self) -> SongList:
-        return SongList([song for songList in self.songLists.values() for song in songList.songs])
+        self._loadAll()
+        return SongList.fromLists(list(self.songLists.values()))
 
     def getLists(self) -> Dict[str, SongList]:
+        self._loadAll()
         return self.songLists
 
-    def compareAllFrequencies(self, title: str = None):
-        SongList.compareSongFrequencies(list(self.songLists.keys()), *self.songLists.values(), title=title)
+    def compareAllFrequencies(self, title: str = None, filename: str = None):
+        self._loadAll()
+        SongList.compareSongFrequencies(list(self.songLists.keys()), *self.songLists.values(), title=title,
+                                        filename=filename)
+
+    def getSongMatrix(self) -> StationSongMatrix:
+        """Station x song play counts over every station in the collection."""
+        self._loadAll()
+        return StationSongMatrix.fromColumns(dict((name, songList.columns) for name, songList in self.songLists.items()))
+
+    def compareStations(self, topN: int = 40, show: bool = True) -> List[Dict]:
+        """Compare every pair of stations: songs in common, Jaccard and cosine similarity, overlap of their topN most
+        played songs and the rank correlation of their play counts."""
+        comparisons = self.getSongMatrix().compare(topN)
+        if show:
+            print('%-24s %7s %8s %7s %8s %8s' % ('Stations', 'shared', 'jaccard', 'cosine', 'top %d' % topN, 'spearman'))
+            for pair in comparisons:
+                print('%-24s %7d %8.3f %7.3f %8d %8.3f' % (' / '.join(pair['stations']), pair['shared'], pair['jaccard'],
+                                                          pair['cosine'], pair['topOverlap'], pair['rankCorrelation']))
+        return comparisons
+
+    @staticmethod
+    def fromSnapshot(filepath: str, start: float = None, end: float = None) -> 'StationPlayCollection':
+        """Open a snapshot file lazily. Stations are only read when used, limited to plays in [start, end)."""
+        collection = StationPlayCollection()
+        collection._snapshot = Snapshot(filepath)
+        collection._snapshotRange = (start, end)
+        return collection
+
+    @staticmethod
+    def fromChain(folder: str, start: float = None, end: float = None) -> 'StationPlayCollection':
+        """Load a snapshot chain (base plus deltas), limited to plays in [start, end)."""
+        collection = StationPlayCollection()
+        for stationName, columns in SnapshotChain(folder).read(start, end).items():
+            collection.songLists[stationName] = SongList.fromColumns(columns)
+        return collection
 
     @staticmethod
     def restore(timestamp: int, folder: str = 'data'):
         filepath = os.path.join(folder, str(timestamp))
         if not os.path.exists(filepath):
             raise RuntimeError('Collection does not exist')
+        if isChain(filepath):
+            return StationPlayCollection.fromChain(filepath)
+        if isSnapshot(filepath):
+            return StationPlayCollection.fromSnapshot(filepath)
         with open(filepath, 'rb') as fp:
             restoredCollection = pickle.load(fp)
         return restoredCollection
 
     @staticmethod
     def getMostRecentSaved(folder='data/', output=True) -> 'StationPlayCollection':
-        """Retrieve the most recently saved collection from a specified folder. Pickle files must be in timestamp format."""
+        """Retrieve the most recently saved collection from a specified folder. Pickle files must be in timestamp format.
+        A folder holding a snapshot chain is loaded from the chain's manifest instead."""
+        if isChain(folder):
+            chain = SnapshotChain(folder)
+            if output: print('[i] Loading snapshot chain: %s' % datetime.fromtimestamp(chain.latest).strftime('%b %d, %I:%M'))
+            return StationPlayCollection.fromChain(folder)
 
         savedCollections = os.listdir(folder)
         newest = 0
@@ -83,13 +232,148 @@ class StationPlayCollection:
             except ValueError:
                 continue
         if output: print('[i] Loading newest collection: %s' % datetime.fromtimestamp(newest).strftime('%b %d, %I:%M'))
-        return StationPlayCollection.restore(newest)
+        return StationPlayCollection.restore(newest, folder=folder)
 
     def showStats(self) -> None:
+        self._loadAll()
         stationNames = self.songLists.keys()
         print('[i] Station Stats:')
         for station in stationNames:
-            print('\t%s - %d' % (station, len(self.songLists[station])))
+            stats = self.songLists[station].stats
+            print('\t%s - %d plays, %d unique (%.1f%%), top 10 played %.1f%% of the time, plays per song %s' %
+                  (station, stats.total, stats.unique, 100 * stats.uniquenessIndex(), 100 * stats.topShare(10),
+                   '/'.join(str(value) for value in stats.fiveNumberSummary()) if stats.unique else '-'))
+
+    def showVariety(self) -> None:
+        """One line of live variety metrics per station (cheap enough to print after every poll)."""
+        print('[i] Variety: %s' % '; '.join('%s %.1f%% unique, top 10 = %.1f%%' %
+                                            (name, 100 * songList.stats.uniquenessIndex(), 100 * songList.stats.topShare(10))
+                                            for name, songList in self.songLists.items()))
+
+
+class _PickledCollection:
+    """Unpickles as a StationPlayCollection of the given columns."""
+
+    def __init__(self, stations: Dict[str, PlayColumns]):
+        self.stations = stations
+
+    def __reduce__(self):
+        return StationPlayCollection, (), {'stationColumns': self.stations}
+
+
+class BackgroundSaver:
+    """Saves a collection on a background thread so polling never waits on the disk. Without chain set, each submit
+    hands the saver thread the stations' columns frozen as they are (see PlayColumns.frozen, nothing is copied), and the
+    full collection is written from them with replaceAtomically. A queued save only keeps alive the arrays the columns
+    have since outgrown, and saves that queue up behind a slow write are folded into the latest. With chain set, each
+    submit copies the plays added since the previous one, and the saver thread writes just those as a delta of the
+    SnapshotChain in folder (compacting it every compactEvery deltas). The queue is bounded. If the disk falls behind,
+    a submit is skipped rather than waited on, and its plays go out with the next save."""
+
+    def __init__(self, folder: str = 'data', snapshot: bool = False, maxPending: int = 4, chain: bool = False,
+                 compactEvery: int = 48):
+        self.folder = folder
+        self.snapshot = snapshot
+        self.queue = queue.Queue(maxsize=maxPending)
+        self.chain = SnapshotChain(folder) if chain else None
+        self.compactEvery = compactEvery
+        # Chain mode: plays not written yet. Otherwise: every station's frozen columns, as last submitted
+        self.pending = {}  # type: Dict[str, PlayColumns]
+        # Chain mode: plays of each station already handed to the saver thread (a chain's plays are already saved)
+        self.submitted = self.chain.playCounts() if chain else {}  # type: Dict[str, int]
+        self.skipped = 0
+        self.lastError = None  # type: Optional[Exception]
+        self.thread = threading.Thread(target=self._run, name='saver', daemon=True)
+        self.thread.start()
+
+    def submit(self, collection: StationPlayCollection, timestamp: int = None, block: bool = False) -> bool:
+        """Queue a save of the collection. Returns False if the queue was full (only when not blocking)."""
+        collection._loadAll()
+        deltas = {}
+        for stationName, songList in collection.songLists.items():
+            if self.chain is None:
+                deltas[stationName] = songList.columns.frozen()
+                continue
+            start = self.submitted.get(stationName, 0)
+            if songList.n > start:
+                deltas[stationName] = songList.columns.take(np.arange(start, songList.n))
+        try:
+            self.queue.put((int(time.time()) if timestamp is None else timestamp, deltas), block=block)
+        except queue.Full:
+            self.skipped += 1
+            METRICS.inc('saves_skipped_total')
+            return False
+        if self.chain is not None:
+            for stationName, delta in deltas.items():
+                self.submitted[stationName] = self.submitted.get(stationName, 0) + len(delta)
+        return True
+
+    def _write(self, timestamp: int) -> None:
+        if self.chain is not None:
+            with METRICS.timer('save_seconds', format='delta'):
+                self.chain.append(self.pending, timestamp)
+            self.pending = {}
+            if len(self.chain) > self.compactEvery:
+                with METRICS.timer('compact_seconds'):
+                    self.chain.compact()
+            return
+
+        filepath = os.path.join(self.folder, str(timestamp))
+        os.makedirs(self.folder, exist_ok=True)
+        with METRICS.timer('save_seconds', format='snapshot' if self.snapshot else 'pickle'):
+            if self.snapshot:
+                replaceAtomically(filepath, lambda path: writeSnapshot(path, self.pending))
+            else:
+                replaceAtomically(filepath, lambda path: StationPlayCollection._pickleColumns(path, self.pending))
+        self.pending = {}
+
+    def _receive(self, deltas: Dict[str, PlayColumns]) -> None:
+        if self.chain is None:
+            self.pending.update(deltas)  # The latest frozen columns hold every earlier play too
+            return
+        for stationName, delta in deltas.items():
+            self.pending.setdefault(stationName, PlayColumns()).extend(delta)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                timestamp, deltas = item
+                self._receive(deltas)
+
+                # Saves that queued up behind a slow write are folded into one
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.queue.task_done()
+                    if item is None:
+                        stopping = True  # Stop after this write
+                        break
+                    timestamp, deltas = item
+                    self._receive(deltas)
+
+                self._write(timestamp)
+            except Exception as e:
+                self.lastError = e
+                print('[-] Background save failed: %r' % e)
+            finally:
+                self.queue.task_done()
+
+    def flush(self) -> None:
+        """Wait until everything submitted so far is on disk."""
+        self.queue.join()
+
+    def close(self, collection: StationPlayCollection = None) -> None:
+        """Save the collection one last time (if given), wait for it to be written and stop the saver thread."""
+        if collection is not None:
+            self.submit(collection, block=True)
+        self.queue.put(None)
+        self.thread.join()
 
 
 class RadioAnalysis:
@@ -97,65 +381,89 @@ class RadioAnalysis:
     def __init__(self, samples: Dict[str, SongList]):
         self.stationSamples = samples
 
-    def showSongPopularityByHour(self, stationName: str=None) -> None:
-        # Collect data
+    def getSongPopularityByHour(self, stationName: str=None) -> np.ndarray:
+        """Average popularity index of the songs played in each of the 24 hours."""
         if stationName is None:
             allSongs = SongList.fromLists(list(self.stationSamples.values()))
         else:
             allSongs = self.stationSamples[stationName]  # Extract one station's songs
-        popularityIndex = dict(allSongs.getPopularityIndices())
+        # Popularity index (share of all plays) of the song behind every play
+        _, inverse, counts = np.unique(allSongs.columns.songKeys(), return_inverse=True, return_counts=True)
+        popularityOfPlays = counts[inverse.reshape(-1)] / allSongs.n
 
-        # Iterate over 24 hours
-        avgPopularityByHour = []
+        # Average over the plays in each of the 24 hours
+        playsAtHour = allSongs.timeIndex.hourCounts()
+        popularityAtHour = np.bincount(allSongs.timeIndex.hours, weights=popularityOfPlays, minlength=24)
+        return np.divide(popularityAtHour, playsAtHour, out=np.zeros(24), where=playsAtHour > 0)
+
+    def showSongPopularityByHour(self, stationName: str=None, filename: str = None) -> None:
         allHours = list(range(24))
-        for hour in allHours:
-            songsAtHour = allSongs.select(hours=hour)
-            nSongsAtHour = len(songsAtHour)
-            hourlyPopularityTotal = sum([popularityIndex[song] for song in songsAtHour.songs]) / nSongsAtHour
-            avgPopularityByHour.append(hourlyPopularityTotal)
+        avgPopularityByHour = self.getSongPopularityByHour(stationName)
 
-        plt.bar(allHours, avgPopularityByHour)
-        plt.title('During which hour of the day is the most popular music played?')
-        plt.xlabel('Hour')
-        plt.ylabel('Average popularity index (sum of each song\'s total play frequency per hour)')
-        plt.show()
+        figure = newFigure(filename)
+        ax = figure.add_subplot(1, 1, 1)
+        ax.bar(allHours, avgPopularityByHour)
+        ax.set_title('During which hour of the day is the most popular music played?')
+        ax.set_xlabel('Hour')
+        ax.set_ylabel('Average popularity index (sum of each song\'s total play frequency per hour)')
+        showOrSave(figure, filename)
 
 
 def getNewSongs(laterSongs: List[PlayedSong], earlierSongs: List[PlayedSong]) -> Optional[List[PlayedSong]]:
-    """Combine two PlayedSong lists while respecting the older timestamp values in the laterSongs list."""
-
-    # Get overlapping section
-    overlap = set(laterSongs).intersection(set(earlierSongs))
-
-    if not overlap:
+    """Return the songs of a fetched list (earlierSongs) that are not already at the end of the stored laterSongs.
+    Kept for older callers, see stitchSongs."""
+    stitch = stitchSongs(laterSongs, earlierSongs)
+    if stitch.gap:
         print('[-] No overlap between songs!')
-    addition = earlierSongs.copy()
-    for item in overlap:
-        addition.remove(item)
-
-    if overlap != set(earlierSongs[-len(overlap):]):
-        print('[-] Error in stitching! \n\tOverlap: %s \n\tLater: %s \n\tEarlier: %s \n\tAdding: %s' %
-              (PlayedSong.showList(overlap), PlayedSong.showList(laterSongs), PlayedSong.showList(earlierSongs), PlayedSong.showList(addition)))
-
-    return addition
-
-
-def collectSongsFromStations(collection: StationPlayCollection, wait: float=5*60, folder: str=None):
-    """This function continuously checks the websites of Air1 and K-LOVE for new songs."""
-
+    return stitch.newSongs
+
+
+def collectSongsFromStations(collection: StationPlayCollection, wait: float=5*60, folder: str=None,
+                             adaptive: bool=False, metricsFile: str=None, metricsFormat: str='prometheus',
+                             saver: BackgroundSaver=None, registry: StationRegistry=None):
+    """This function continuously checks the websites of the registry's enabled stations (by default Air1, K-LOVE and
+    KISS, see StationRegistry) for new songs. Every station is polled each `wait` seconds, or, if adaptive is set, as
+    rarely as its recently played list allows (see PollScheduler).
+    With a metricsFile, per-stage timings and counters are exported to it after every cycle (see Metrics).
+    Saves run on the saver's thread (one is started if the collection has no play log and none is given)."""
+    if metricsFile is not None:
+        METRICS.enabled = True
+    if saver is None and collection.log is None:
+        saver = BackgroundSaver(folder or 'data')
+
+    registry = defaultRegistry() if registry is None else registry
+    fetcher = StationFetcher(registry.scrapers(), timeouts=registry.timeouts())
+    scheduler = PollScheduler(list(registry.scrapers()), wait, adaptive=adaptive)
+    lastSave = time.time()
     while True:
-        # Retrieve songs from Air1 and KLOVE
-        for i in range(2):
-            # Add more stations here <---
-            writeSongsToCollectionAIR1(collection)
-            writeSongsToCollectionKLOVE(collection)
-            writeSongsToCollectionKISS(collection)
+        # Retrieve songs from every due station at once, adding them from this thread only
+        cycleStarted = time.perf_counter()
+        for stationName, songs in fetcher.fetchAll(scheduler.dueStations()):
+            if songs is None:
+                print('[%s] Unchanged' % stationName)
+                scheduler.record(stationName, [], [])
+                continue
+            added = collection.add(stationName, songs) if songs else []
+            scheduler.record(stationName, songs, added)
+        collection.showVariety()
+        if adaptive:
+            print('[i] Next polls: %s' % scheduler.showSchedule())
+        else:
             print('[i] Waiting %d minutes' % (wait / 60))
-            time.sleep(wait)
-
-        # Every two additions, save collection
-        collection.showStats()
-        print('[i] Saving collection (%s)...' % (datetime.now().strftime("%I:%M")), end='')
-        collection.save(folder=folder)
-        print('saved!')
 
+        # Every two waits, save collection (unless a play log already holds every accepted play)
+        if time.time() - lastSave >= 2 * wait:
+            lastSave = time.time()
+            collection.showStats()
+            if collection.log is None:
+                if saver.submit(collection):
+                    print('[i] Saving collection in the background (%s)' % datetime.now().strftime("%I:%M"))
+                else:
+                    print('[-] Previous saves are still being written, saving later')
+
+        METRICS.observe('cycle_seconds', time.perf_counter() - cycleStarted)
+        METRICS.set('plays_stored', sum(len(songList) for songList in collection.songLists.values()))
+        if metricsFile is not None:
+            METRICS.export(metricsFile, metricsFormat)
+
+        time.sleep(max(scheduler.nextPollTime() - time.time(), 0))
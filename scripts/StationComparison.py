@@ -0,0 +1,122 @@
+from scripts.SongClasses import *
+
+"""
+StationComparison
+    Compares the song rotations of any number of stations at once. All plays are counted into one sparse station x song
+    matrix (CSR: each station's row holds only the songs it played), and every station pair is compared from that
+    matrix with a few matrix products instead of pair-by-pair list walks.
+"""
+
+
+class StationSongMatrix:
+    """Play counts of every song on every station. Rows are stations, columns are the songs played by any of them."""
+
+    def __init__(self, stationNames: List[str], songIds: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 counts: np.ndarray):
+        self.stationNames = stationNames
+        self.songIds = songIds  # Column -> catalog song id
+        self.indptr = indptr  # Station i's entries are indices/counts[indptr[i]:indptr[i+1]]
+        self.indices = indices  # Column of each entry
+        self.counts = counts  # Plays of each entry
+
+    @staticmethod
+    def fromColumns(stations: Dict[str, PlayColumns]) -> 'StationSongMatrix':
+        """Count every station's plays in a single pass over all of them."""
+        stationNames = list(stations.keys())
+        rows = np.concatenate([np.full(len(columns), i, dtype=np.int64) for i, columns in enumerate(stations.values())]
+                              + [np.zeros(0, dtype=np.int64)])
+        songIds = np.concatenate([columns.songIds for columns in stations.values()] + [np.zeros(0, dtype=np.int32)])
+
+        # Compact the songs to columns, then count each (station, column) cell once
+        uniqueSongIds, songColumns = np.unique(songIds, return_inverse=True)
+        cells, counts = np.unique(rows * len(uniqueSongIds) + songColumns.reshape(-1), return_counts=True)
+        cellRows = cells // max(len(uniqueSongIds), 1)
+        indptr = np.searchsorted(cellRows, np.arange(len(stationNames) + 1), side='left')
+        return StationSongMatrix(stationNames, uniqueSongIds, indptr, cells % max(len(uniqueSongIds), 1), counts)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.stationNames), len(self.songIds)
+
+    def row(self, station: Union[int, str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(columns, play counts) of the songs one station played."""
+        i = station if isinstance(station, int) else self.stationNames.index(station)
+        return self.indices[self.indptr[i]:self.indptr[i + 1]], self.counts[self.indptr[i]:self.indptr[i + 1]]
+
+    def toDense(self, dtype=np.float64) -> np.ndarray:
+        dense = np.zeros(self.shape, dtype=dtype)
+        dense[np.repeat(np.arange(len(self.stationNames)), np.diff(self.indptr)), self.indices] = self.counts
+        return dense
+
+    def topSongs(self, n: int) -> np.ndarray:
+        """Stations x songs mask of each station's n most played songs (ties go to the earlier column)."""
+        mask = np.zeros(self.shape, dtype=bool)
+        for i in range(len(self.stationNames)):
+            columns, counts = self.row(i)
+            mask[i, columns[np.argsort(-counts, kind='stable')[:n]]] = True
+        return mask
+
+    def sharedSongs(self, dense: np.ndarray = None) -> np.ndarray:
+        """Stations x stations count of songs both stations played (the diagonal is each station's catalog size). The
+        metrics take the matrix from toDense() when the caller already has it, so compare() only builds it once."""
+        played = ((self.toDense() if dense is None else dense) > 0).astype(np.float64)
+        return (played @ played.T).round().astype(np.int64)
+
+    def jaccard(self, shared: np.ndarray = None) -> np.ndarray:
+        shared = self.sharedSongs() if shared is None else shared
+        sizes = np.diag(shared)
+        union = sizes[:, None] + sizes[None, :] - shared
+        return np.divide(shared, union, out=np.zeros(shared.shape), where=union > 0)
+
+    def cosine(self, dense: np.ndarray = None) -> np.ndarray:
+        """Cosine similarity of the stations' play count vectors: 1 when they split their airtime the same way."""
+        dense = self.toDense() if dense is None else dense
+        norms = np.sqrt((dense ** 2).sum(axis=1))
+        products = norms[:, None] * norms[None, :]
+        return np.divide(dense @ dense.T, products, out=np.zeros(products.shape), where=products > 0)
+
+    def topOverlap(self, n: int = 40) -> np.ndarray:
+        """Stations x stations count of songs that are in both stations' n most played."""
+        top = self.topSongs(n).astype(np.float64)
+        return (top @ top.T).round().astype(np.int64)
+
+    def rankCorrelation(self, dense: np.ndarray = None) -> np.ndarray:
+        """Spearman correlation of play counts over the songs each pair of stations shares: positive when the songs
+        one station favors are also the ones the other favors. NaN for pairs that share fewer than 3 songs."""
+        dense = self.toDense() if dense is None else dense
+        nStations = len(self.stationNames)
+        output = np.full((nStations, nStations), np.nan)
+        for i in range(nStations):
+            for j in range(i, nStations):
+                shared = (dense[i] > 0) & (dense[j] > 0)
+                if shared.sum() < 3:
+                    continue
+                ranks = np.array([_ranks(dense[i, shared]), _ranks(dense[j, shared])])
+                if ranks[0].std() == 0 or ranks[1].std() == 0:
+                    continue
+                output[i, j] = output[j, i] = np.corrcoef(ranks)[0, 1]
+        return output
+
+    def compare(self, topN: int = 40) -> List[Dict]:
+        """Every metric for every station pair, one dict per pair."""
+        dense = self.toDense()
+        shared = self.sharedSongs(dense)
+        jaccard, cosine = self.jaccard(shared), self.cosine(dense)
+        topOverlap, rankCorrelation = self.topOverlap(topN), self.rankCorrelation(dense)
+        output = []
+        for i in range(len(self.stationNames)):
+            for j in range(i + 1, len(self.stationNames)):
+                output.append({'stations': (self.stationNames[i], self.stationNames[j]),
+                               'shared': int(shared[i, j]),
+                               'jaccard': float(jaccard[i, j]),
+                               'cosine': float(cosine[i, j]),
+                               'topOverlap': int(topOverlap[i, j]),
+                               'rankCorrelation': float(rankCorrelation[i, j])})
+        return output
+
+
+def _ranks(values: np.ndarray) -> np.ndarray:
+    """Ranks starting at 1, with tied values sharing the average of their ranks."""
+    uniqueValues, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    averageRanks = np.cumsum(counts) - (counts - 1) / 2
+    return averageRanks[inverse.reshape(-1)]
@@ -1,38 +1,137 @@
 from scripts.SongClasses import *
+from scripts.Metrics import METRICS
 import requests, json
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from http.client import RemoteDisconnected
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
+import hashlib, re
 
 """
 StationInterfaces
     These functions are the interface between a radio station and PlayedSongs. They scrape the station's website for 
     recently played songs and fill out the PlayedSong datatype according to the data that the website provides.
+    BeautifulSoup is imported by the first HTML page parsed, so collecting only JSON stations never loads it.
 """
 
 # URLs of radio stations
 AIR1_URL_RECENTLY_PLAYED = "https://www.air1.com/listen/recently-played"
 KLOVE_URL_RECENTLY_PLAYED = "http://c.kloveair1.com/Services/Broadcast.asmx/GetRecentSongsLimit?siteId=1&limit=5&RemoveTags=true&format=json"
 KISS_URL_RECENTLY_PLAYED = "https://1035kissfm.iheart.com/music/"
-FISH_URL_RECENTLY_PLAYED = "'https://thefishoc.com/lastsongs'"
+FISH_URL_RECENTLY_PLAYED = "https://thefishoc.com/lastsongs"
 
+DEFAULT_TIMEOUT = 5  # Seconds to wait on a station's website
 
-def getRecentlyPlayedAIR1() -> List[PlayedSong]:
-    """Get a list of Songs played."""
+# The part of each station's page that holds its playlist. With fast parsing only this subtree is parsed.
+AIR1_PLAYLIST = ('div', {'class': 'recently-played-wrapper'})
+KISS_PLAYLIST = ('ol', {'class': 'component-playlist-items on-demand-target thumbs-target'})
+FISH_PLAYLIST = ('table', {'class': 'table-data'})
 
-    # Output
-    songsProcessed = []
 
-    # Get page
+def createSession(retries: int = 3, backoff: float = 0.5) -> requests.Session:
+    """A keep-alive session that retries failed connections and 5xx responses with exponential backoff."""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ResponseCache:
+    """Remembers the last response from one station's page. Requests are made conditional (If-None-Match and
+    If-Modified-Since) when the server sends validators, and a page whose bytes hash the same as last time is treated
+    as unchanged, so most polls can skip parsing and stitching entirely."""
+
+    def __init__(self):
+        self.etag = None  # type: Optional[str]
+        self.lastModified = None  # type: Optional[str]
+        self.digest = None  # type: Optional[bytes]
+
+    def get(self, url: str, session: requests.Session = None, timeout: float = DEFAULT_TIMEOUT) -> Optional[str]:
+        """Return the page's text, or None if it has not changed since the last call."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+        page = (session or requests).get(url, timeout=timeout, headers=headers)
+        if page.status_code == 304:
+            return None
+        self.etag = page.headers.get('ETag')
+        self.lastModified = page.headers.get('Last-Modified')
+
+        digest = hashlib.blake2b(page.content, digest_size=16).digest()
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        return page.text
+
+
+def _parsePlaylist(page: str, playlist: Tuple[str, Dict[str, str]], fast: bool) -> 'BeautifulSoup':
+    """Parse a station page with html.parser. The fast path cuts the playlist element out of the page text and only
+    builds a tree for that element (SoupStrainer), instead of parsing the whole document. If the element can't be
+    located in the text, the whole page is tokenized but still only the playlist subtree is built."""
+    from bs4 import BeautifulSoup, SoupStrainer
+    if not fast:
+        return BeautifulSoup(page, 'html.parser')
+
+    # Only tokenize from the playlist's opening tag to its matching closing tag, found with a cheap regex scan
+    name, attrs = playlist
+    marker = page.find('"%s"' % attrs['class'])
+    tagStart = page.rfind('<' + name, 0, marker) if marker >= 0 else -1
+    if tagStart >= 0:
+        depth = 0
+        for tag in re.finditer(r'<(/?)%s\b' % name, page[tagStart:]):
+            depth += -1 if tag.group(1) else 1
+            if depth == 0:
+                tagEnd = page.find('>', tagStart + tag.end())
+                page = page[tagStart:tagEnd + 1 if tagEnd >= 0 else len(page)]
+                break
+        else:
+            page = page[tagStart:]
+    return BeautifulSoup(page, 'html.parser', parse_only=SoupStrainer(name, attrs=attrs))
+
+
+def _getPage(url: str, session: requests.Session, timeout: float, cache: Optional[ResponseCache]) -> Optional[str]:
+    if cache is not None:
+        return cache.get(url, session, timeout)
+    return (session or requests).get(url, timeout=timeout).text
+
+
+def _getRecentlyPlayed(stationName: str, url: str, parse: Callable[[str], List[PlayedSong]], session: requests.Session,
+                       timeout: float, cache: Optional[ResponseCache]) -> Optional[List[PlayedSong]]:
+    """Fetch and parse one station's recently played list, timing both stages."""
     try:
-        page = requests.get(AIR1_URL_RECENTLY_PLAYED, timeout=5)
+        with METRICS.timer('fetch_seconds', station=stationName):
+            page = _getPage(url, session, timeout, cache)
     except requests.exceptions.Timeout:
-        print('[-] Timeout getting Air1 songs.')
+        print('[-] Timeout getting %s songs.' % stationName)
+        METRICS.inc('fetches_total', station=stationName, result='timeout')
         return []
+    if page is None:
+        METRICS.inc('fetches_total', station=stationName, result='unchanged')
+        return None
+    METRICS.inc('fetches_total', station=stationName, result='ok')
+    with METRICS.timer('parse_seconds', station=stationName):
+        songs = parse(page)
+    METRICS.inc('songs_fetched_total', len(songs), station=stationName)
+    return songs
+
+
+def getRecentlyPlayedAIR1(session: requests.Session = None, timeout: float = DEFAULT_TIMEOUT,
+                          cache: ResponseCache = None) -> Optional[List[PlayedSong]]:
+    """Get a list of Songs played. Returns None when a cache is given and the page has not changed."""
+    return _getRecentlyPlayed('Air1', AIR1_URL_RECENTLY_PLAYED, parseAIR1, session, timeout, cache)
+def parseAIR1(page: str, fast: bool = True, stationName: str = 'Air1') -> List[PlayedSong]:
+    # Output
+    songsProcessed = []
 
     # Parse HTML
     try:
-        parser = BeautifulSoup(page.text, 'html.parser')
-        recently_played = parser.find('div', attrs={'class': 'recently-played-wrapper'})
+        parser = _parsePlaylist(page, AIR1_PLAYLIST, fast)
+        recently_played = parser.find(*AIR1_PLAYLIST)
         songsRaw = recently_played.findAll('div', attrs={'class': 'song-wrapper'})
     except AttributeError:
         return []
@@ -45,7 +144,7 @@ def getRecentlyPlayedAIR1() -> List[PlayedSong]:
         if title not in titles:
             # print('PlayedSong:\n\ttitle: %s\n\tartist: %s\n\talbum: %s\n' % (title, artist, album))
             titles.append(title)
-            songsProcessed.append(PlayedSong(title, artist, album, 'Air1'))
+            songsProcessed.append(PlayedSong(title, artist, album, stationName))
 
     return songsProcessed
 def writeSongsToCollectionAIR1(collection):
@@ -56,32 +155,30 @@ def writeSongsToCollectionAIR1(collection):
         print('[-] Error: RemoteDisconnected from Air1, continuing anyways')
 
 
-def getRecentlyPlayedKLOVE() -> List[PlayedSong]:
+def getRecentlyPlayedKLOVE(session: requests.Session = None, timeout: float = DEFAULT_TIMEOUT,
+                           cache: ResponseCache = None) -> Optional[List[PlayedSong]]:
+    return _getRecentlyPlayed('KLOVE', KLOVE_URL_RECENTLY_PLAYED, parseKLOVE, session, timeout, cache)
+def parseKLOVE(jsonPage: str, stationName: str = 'KLOVE') -> List[PlayedSong]:
     # Output
     processedSongs = []
 
-    # Get and parse JSON response
-    try:
-        jsonPage = requests.get(KLOVE_URL_RECENTLY_PLAYED)
-    except requests.exceptions.Timeout:
-        print('[-] Timeout getting KLOVE songs.')
-        return []
-    obj = json.loads(jsonPage.text[1:-2])
+    # Parse JSON response
+    obj = json.loads(jsonPage[1:-2])
 
     # Get the fields from JSON
     data = obj.get('d')
-    titles = []
+    plays = set()
     for song in data:
         title = song.get('Title')
         artist = song.get('Artist')
         album = song.get('Album')
-        if title is None or title in titles:
-            continue
-        titles.append(title)
+        if title is None or (title, song.get('StartDate')) in plays:
+            continue  # Listed twice, but a song repeated later in the list is a separate play
+        plays.add((title, song.get('StartDate')))
         timestamp = int(song.get('StartDate')[6:-2]) / 1000
         # print('PlayedSong:\n\ttitle: %s\n\tartist: %s\n\talbum: %s\ntimestamp: %d\n' %
         #       (title, artist, album, timestamp))
-        processedSongs.append(PlayedSong(title, artist, album, 'KLOVE', timestamp=timestamp))
+        processedSongs.append(PlayedSong(title, artist, album, stationName, timestamp=timestamp))
 
     return processedSongs
 def writeSongsToCollectionKLOVE(collection):
@@ -92,19 +189,16 @@ def writeSongsToCollectionKLOVE(collection):
         print('[-] Error: RemoteDisconnected from KLOVE, continuing anyways')
 
 
-def getRecentlyPlayedKISS() -> List[PlayedSong]:
-    # Get webpage
-    page = None
-    try:
-        page = requests.get(KISS_URL_RECENTLY_PLAYED, timeout=5)
-    except requests.exceptions.Timeout:
-        print('[-] Timeout getting KISS songs.')
-
+def getRecentlyPlayedKISS(session: requests.Session = None, timeout: float = DEFAULT_TIMEOUT,
+                          cache: ResponseCache = None) -> Optional[List[PlayedSong]]:
+    return _getRecentlyPlayed('KISS', KISS_URL_RECENTLY_PLAYED, parseKISS, session, timeout, cache)
+def parseKISS(page: str, fast: bool = True, stationName: str = 'KISS') -> List[PlayedSong]:
     # Parse HTML
-    parser = BeautifulSoup(page.text, 'html.parser')
-    songsHTML = parser.find('ol', attrs={'class': 'component-playlist-items on-demand-target thumbs-target'})
+    parser = _parsePlaylist(page, KISS_PLAYLIST, fast)
+    songsHTML = parser.find(*KISS_PLAYLIST)
     if songsHTML is None:
-        print('[-] Could not parse KISS recently played page.')
+        print('[-] Could not parse %s recently played page.' % stationName)
+        return []
     songsHTML = songsHTML.findAll('li', attrs={'class': 'playlist-track-container ondemand-track'})
 
     # Iterate through songs
@@ -116,7 +210,7 @@ def getRecentlyPlayedKISS() -> List[PlayedSong]:
         artist = artistHTML.text
         dateStr = fields.find('time').attrs['datetime'][:-6]
         timestamp = datetime.strptime(dateStr, "%Y-%m-%d %H:%M:%S").timestamp()
-        output.append(PlayedSong(title, artist, '?', 'KISS', timestamp=timestamp))
+        output.append(PlayedSong(title, artist, '?', stationName, timestamp=timestamp))
     return output
 def writeSongsToCollectionKISS(collection):
     try:
@@ -126,17 +220,13 @@ def writeSongsToCollectionKISS(collection):
         print('[-] Error: RemoteDisconnected from KISS, continuing anyways')
 
 
-def getRecentlyPlayedFISH() -> List[PlayedSong]:
-    # Get page
-    page = None
-    try:
-        page = requests.get('https://thefishoc.com/lastsongs')
-    except requests.exceptions.Timeout:
-        print('[-] Timeout getting the FISH songs.')
-
+def getRecentlyPlayedFISH(session: requests.Session = None, timeout: float = DEFAULT_TIMEOUT,
+                          cache: ResponseCache = None) -> Optional[List[PlayedSong]]:
+    return _getRecentlyPlayed('FISH', FISH_URL_RECENTLY_PLAYED, parseFISH, session, timeout, cache)
+def parseFISH(page: str, fast: bool = True, stationName: str = 'FISH') -> List[PlayedSong]:
     # Parse HTML
-    parser = BeautifulSoup(page.text, 'html.parser')
-    tableHTML = parser.find('table', attrs={'class': 'table-data'})
+    parser = _parsePlaylist(page, FISH_PLAYLIST, fast)
+    tableHTML = parser.find(*FISH_PLAYLIST)
 
     # Iterate through the table rows
     songs = []
@@ -151,7 +241,7 @@ def getRecentlyPlayedFISH() -> List[PlayedSong]:
         dt = datetime.strptime(timeStr, '%I:%M %p')
         timestamp = timestamp.replace(minute=dt.minute, hour=dt.hour+3).timestamp()
 
-        songs.append(PlayedSong(title, artist, '?', 'FISH', timestamp=timestamp))
+        songs.append(PlayedSong(title, artist, '?', stationName, timestamp=timestamp))
         # print(title, timestamp)
 
     return songs
@@ -161,3 +251,42 @@ def writeSongsToCollectionFISH(collection):
         collection.add('FISH', moreSongs)
     except RemoteDisconnected:
         print('[-] Error: RemoteDisconnected from FISH, continuing anyways')
+
+
+class StationFetcher:
+    """Polls stations in parallel on a thread pool. Each station keeps its own pooled keep-alive session and
+    ResponseCache, so one slow station no longer holds up the rest and unchanged pages are not parsed again. Results are
+    yielded back to the calling thread, which stays the only writer."""
+
+    def __init__(self, scrapers: Dict[str, Callable[..., List[PlayedSong]]], timeout: float = DEFAULT_TIMEOUT,
+                 timeouts: Dict[str, float] = None, retries: int = 3, backoff: float = 0.5):
+        self.scrapers = scrapers
+        self.timeouts = dict((name, (timeouts or {}).get(name, timeout)) for name in scrapers)
+        self.sessions = dict((name, createSession(retries, backoff)) for name in scrapers)
+        self.caches = dict((name, ResponseCache()) for name in scrapers)
+        self.pool = ThreadPoolExecutor(max_workers=max(len(scrapers), 1), thread_name_prefix='fetch')
+
+    def _fetch(self, stationName: str) -> Optional[List[PlayedSong]]:
+        try:
+            return self.scrapers[stationName](session=self.sessions[stationName], timeout=self.timeouts[stationName],
+                                              cache=self.caches[stationName])
+        except (RemoteDisconnected, requests.exceptions.RequestException) as e:
+            print('[-] Error getting %s songs (%s), continuing anyways' % (stationName, e.__class__.__name__))
+            METRICS.inc('fetches_total', station=stationName, result='error')
+        except Exception as e:
+            print('[-] Error parsing %s songs: %r' % (stationName, e))
+            METRICS.inc('parse_errors_total', station=stationName)
+        return []
+
+    def fetchAll(self, stationNames: List[str] = None) -> Iterator[Tuple[str, Optional[List[PlayedSong]]]]:
+        """Fetch every station (or only the named ones, which may be none) at once, yielding (station, songs) as each
+        one finishes. songs is None when the station's page has not changed since it was last fetched."""
+        stationNames = list(self.scrapers) if stationNames is None else stationNames
+        futures = dict((self.pool.submit(self._fetch, name), name) for name in stationNames)
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False)
+        for session in self.sessions.values():
+            session.close()
@@ -0,0 +1,147 @@
+from scripts.StationInterfaces import *
+from scripts.StationInterfaces import _getRecentlyPlayed
+
+"""
+StationRegistry
+    The stations the collector polls, each named with the parser that reads its recently played page and the URL to
+    fetch it from. The built-in stations are registered by defaultRegistry(). More stations can be listed in a JSON file
+    instead of adding them in code, as long as their pages have the layout of one of the PARSERS (every iHeart station
+    shares the 'iheart' layout, for example):
+
+    {"stations": [{"name": "KISS", "parser": "iheart", "url": "https://1035kissfm.iheart.com/music/"},
+                  {"name": "KIIS", "parser": "iheart", "url": "https://kiisfm.iheart.com/music/", "timeout": 10},
+                  {"name": "FISH", "parser": "fish", "enabled": false}]}
+
+    With a ResponseRecorder attached, every page a station returns is also appended to a JSON lines file, to be replayed
+    offline by StationReplay.
+"""
+
+# Parser name -> (function reading a recently played page, URL of the station it was written for)
+PARSERS = {
+    'air1': (parseAIR1, AIR1_URL_RECENTLY_PLAYED),
+    'klove': (parseKLOVE, KLOVE_URL_RECENTLY_PLAYED),
+    'iheart': (parseKISS, KISS_URL_RECENTLY_PLAYED),
+    'fish': (parseFISH, FISH_URL_RECENTLY_PLAYED),
+}
+
+
+class ResponseRecorder:
+    """Appends the pages fetched from stations to a JSON lines file with the time each was fetched:
+    {"time": ..., "station": ..., "parser": ..., "url": ..., "page": ...}. Pages the ResponseCache found unchanged are
+    never parsed, so they are not recorded again either."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.fp = open(filename, 'a', encoding='utf-8')
+        self.lock = threading.Lock()  # Stations are fetched on several threads
+        self.recorded = 0
+
+    def record(self, station: 'Station', page: str, fetched: float = None) -> None:
+        line = json.dumps({'time': time.time() if fetched is None else fetched, 'station': station.name,
+                           'parser': station.parser, 'url': station.url, 'page': page})
+        with self.lock:
+            self.fp.write(line + '\n')
+            self.fp.flush()
+            self.recorded += 1
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+class Station:
+    """One station to collect. Only plain fields are kept, so stations can be sent to collector worker processes."""
+
+    def __init__(self, name: str, parser: str, url: str = None, timeout: float = DEFAULT_TIMEOUT,
+                 enabled: bool = True):
+        if parser not in PARSERS:
+            raise RuntimeError('Unknown parser %s for station %s (known: %s)' % (parser, name, ', '.join(PARSERS)))
+        self.name = name
+        self.parser = parser
+        self.url = url or PARSERS[parser][1]
+        self.timeout = timeout
+        self.enabled = enabled
+        self.recorder = None  # type: Optional[ResponseRecorder]
+
+    def __repr__(self):
+        return '<Station %s (%s) %s%s>' % (self.name, self.parser, self.url, '' if self.enabled else ' disabled')
+
+    def parse(self, page: str) -> List[PlayedSong]:
+        if self.recorder is not None:
+            self.recorder.record(self, page)
+        return PARSERS[self.parser][0](page, stationName=self.name)
+
+    def getRecentlyPlayed(self, session: requests.Session = None, timeout: float = None,
+                          cache: ResponseCache = None) -> Optional[List[PlayedSong]]:
+        """Fetch and parse the station's recently played list, like the getRecentlyPlayedX functions."""
+        return _getRecentlyPlayed(self.name, self.url, self.parse, session,
+                                  self.timeout if timeout is None else timeout, cache)
+
+    def toJson(self) -> dict:
+        return {'name': self.name, 'parser': self.parser, 'url': self.url, 'timeout': self.timeout,
+                'enabled': self.enabled}
+
+    @staticmethod
+    def fromJson(entry: dict) -> 'Station':
+        return Station(entry['name'], entry['parser'], entry.get('url'), entry.get('timeout', DEFAULT_TIMEOUT),
+                       entry.get('enabled', True))
+
+
+class StationRegistry:
+
+    def __init__(self, stations: List[Station] = ()):
+        self.stations = {}  # type: Dict[str, Station]
+        for station in stations:
+            self.add(station)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, stationName: str) -> bool:
+        return stationName in self.stations
+
+    def __getitem__(self, stationName: str) -> Station:
+        return self.stations[stationName]
+
+    def add(self, station: Station) -> None:
+        if station.name in self.stations:
+            raise RuntimeError('Station %s is registered twice' % station.name)
+        self.stations[station.name] = station
+
+    def enabled(self) -> List[Station]:
+        return [station for station in self.stations.values() if station.enabled]
+
+    def scrapers(self) -> Dict[str, Callable[..., Optional[List[PlayedSong]]]]:
+        """Enabled station name -> scraper, as StationFetcher takes them."""
+        return dict((station.name, station.getRecentlyPlayed) for station in self.enabled())
+
+    def timeouts(self) -> Dict[str, float]:
+        return dict((station.name, station.timeout) for station in self.enabled())
+
+    def overrideUrls(self, urls: Dict[str, str]) -> None:
+        """Fetch the named stations from other URLs (a mirror, or a local stand-in server)."""
+        for stationName, url in urls.items():
+            self.stations[stationName].url = url
+
+    def record(self, recorder: Optional[ResponseRecorder]) -> None:
+        """Record every station's pages with the recorder (None stops recording)."""
+        for station in self.stations.values():
+            station.recorder = recorder
+
+    def save(self, filename: str) -> None:
+        with open(filename, 'w') as fp:
+            json.dump({'stations': [station.toJson() for station in self.stations.values()]}, fp, indent=1)
+
+    @staticmethod
+    def load(filename: str) -> 'StationRegistry':
+        with open(filename) as fp:
+            return StationRegistry([Station.fromJson(entry) for entry in json.load(fp)['stations']])
+
+
+def defaultRegistry() -> StationRegistry:
+    """The stations collected when no station file is given."""
+    return StationRegistry([
+        Station('Air1', 'air1'),
+        Station('KLOVE', 'klove'),
+        Station('KISS', 'iheart'),
+        Station('FISH', 'fish', enabled=False),  # Its page only shows times of day, so plays can't be dated reliably
+    ])
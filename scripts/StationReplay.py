@@ -0,0 +1,254 @@
+from scripts.SongCollection import *
+from scripts.StationRegistry import Station
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote
+import html
+
+"""
+StationReplay
+    Replays recorded station pages (see ResponseRecorder, collect --record) from a local HTTP server that stands in for
+    the stations' websites, so the collector can be run offline. The replay clock can run faster than real time (a week
+    of polls in minutes) and every recorded station can be served as several synthetic stations, so collector
+    throughput and stitching accuracy can be load tested. The collector is pointed at the server with the registry it
+    writes out, whose URLs are overridden to the server's.
+
+    GET /               replay status: {"replayTime": ..., "start": ..., "end": ..., "done": ..., "served": ...}
+    GET /<station>      the station's latest page recorded at or before the replay time (ETag and If-None-Match are
+                        supported, so ResponseCache sees unchanged pages as it would live)
+
+    Recordings can also be generated from a synthetic play history (writeSyntheticRecording) as K-LOVE style JSON
+    pages, which carry play times, and Air1 style HTML pages, which don't, for tests that don't have a real recording.
+"""
+
+
+class Recording:
+    """Index of a recording: each station's fetch times and where its pages are in the file. Pages are only read from
+    the file when they are served, so a week of recorded HTML never has to be in memory."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.parsers = {}  # type: Dict[str, str]
+        times, offsets = {}, {}  # type: Dict[str, List[float]], Dict[str, List[int]]
+        with open(filename, 'rb') as fp:
+            offset = 0
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.parsers[entry['station']] = entry['parser']
+                    times.setdefault(entry['station'], []).append(entry['time'])
+                    offsets.setdefault(entry['station'], []).append(offset)
+                offset += len(line)
+        if not times:
+            raise RuntimeError('%s has no recorded pages' % filename)
+
+        self.times = {}  # type: Dict[str, np.ndarray]
+        self.offsets = {}  # type: Dict[str, np.ndarray]
+        for stationName in times:
+            order = np.argsort(times[stationName], kind='stable')
+            self.times[stationName] = np.asarray(times[stationName], dtype=np.float64)[order]
+            self.offsets[stationName] = np.asarray(offsets[stationName], dtype=np.int64)[order]
+        self.start = min(stationTimes[0] for stationTimes in self.times.values())
+        self.end = max(stationTimes[-1] for stationTimes in self.times.values())
+        self.fp = open(filename, 'rb')
+        self.lock = threading.Lock()  # Pages are served on several threads
+
+    def __len__(self):
+        return sum(len(stationTimes) for stationTimes in self.times.values())
+
+    def stations(self) -> List[str]:
+        return list(self.times.keys())
+
+    def pageAt(self, stationName: str, timestamp: float) -> int:
+        """Index of the station's latest page fetched at or before timestamp (its first page before that)."""
+        return max(int(np.searchsorted(self.times[stationName], timestamp, side='right')) - 1, 0)
+
+    def page(self, stationName: str, index: int) -> str:
+        with self.lock:
+            self.fp.seek(int(self.offsets[stationName][index]))
+            return json.loads(self.fp.readline())['page']
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+def _kloveStylePage(songs: List[Song], timestamps: List[float]) -> str:
+    return '(%s);' % json.dumps({'d': [{'Title': song.title, 'Artist': song.artist, 'Album': song.album,
+                                        'StartDate': '/Date(%d)/' % round(timestamp * 1000)}
+                                       for song, timestamp in zip(songs, timestamps)]})
+
+
+def _air1StylePage(songs: List[Song], timestamps: List[float]) -> str:
+    return '<div class="%s">%s</div>' % (AIR1_PLAYLIST[1]['class'], ''.join(
+        '<div class="song-wrapper">\n<h5>%s</h5>\n<p>%s</p>\n<p>%s</p>\n</div>' %
+        (html.escape(song.title), html.escape(song.artist or '?'), html.escape(song.album or '?')) for song in songs))
+
+
+SYNTHETIC_PAGES = {'klove': _kloveStylePage, 'air1': _air1StylePage}
+
+
+def _withSeparation(columns: PlayColumns, separation: int) -> PlayColumns:
+    """Drop the plays of a song that aired again within `separation` plays, like a station's rotation rules would."""
+    kept, lastKept = [], {}  # type: List[int], Dict[int, int]
+    for position, songId in enumerate(columns.songIds.tolist()):
+        if len(kept) - lastKept.get(songId, -separation) >= separation:
+            lastKept[songId] = len(kept)
+            kept.append(position)
+    return columns.take(np.array(kept, dtype=np.int64))
+
+
+def writeSyntheticRecording(filename: str, collection: StationPlayCollection, every: float = 60, depth: int = 5,
+                            parsers: Tuple[str, ...] = ('klove', 'air1')) -> int:
+    """Record what polling each station of a (synthetic) collection every `every` seconds would have fetched: pages with
+    the station's last `depth` plays, shaped like the pages of the parsers given (taken in turn by the stations). A song
+    is never repeated within a page, as stations space out their rotations and Air1 style pages are deduplicated by
+    title. Only changed pages are written, like ResponseRecorder. Returns the number of pages."""
+    written = 0
+    with open(filename, 'w', encoding='utf-8') as fp:
+        for i, (stationName, songList) in enumerate(collection.getLists().items()):
+            parser = parsers[i % len(parsers)]
+            columns = _withSeparation(songList.columns.take(np.argsort(songList.columns.timestamps, kind='stable')),
+                                      depth)
+            lastEnd = 0
+            for pollTime in np.arange(columns.timestamps[0], columns.timestamps[-1] + every, every):
+                end = int(np.searchsorted(columns.timestamps, pollTime, side='right'))
+                if end == lastEnd:
+                    continue
+                lastEnd = end
+                songs = [CATALOG.songs[songId] for songId in columns.songIds[max(end - depth, 0):end][::-1].tolist()]
+                page = SYNTHETIC_PAGES[parser](songs, columns.timestamps[max(end - depth, 0):end][::-1].tolist())
+                fp.write(json.dumps({'time': float(pollTime), 'station': stationName, 'parser': parser, 'url': None,
+                                     'page': page}) + '\n')
+                written += 1
+    return written
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        replay = self.server.replay  # type: ReplayServer
+        stationName = unquote(self.path.lstrip('/'))
+        if not stationName:
+            self._send(200, json.dumps(replay.status()).encode('utf-8'), 'application/json')
+            return
+        source = replay.sources.get(stationName)
+        if source is None:
+            self._send(404, b'Unknown station', 'text/plain')
+            return
+
+        index = replay.recording.pageAt(source, replay.replayTime())
+        etag = '"%d"' % index
+        replay.served += 1
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, b'', None, etag)
+            return
+        self._send(200, replay.recording.page(source, index).encode('utf-8'), 'text/html; charset=utf-8', etag)
+
+    def _send(self, status: int, body: bytes, contentType: Optional[str], etag: str = None) -> None:
+        self.send_response(status)
+        if contentType:
+            self.send_header('Content-Type', contentType)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # A load test makes thousands of requests
+
+
+class ReplayServer:
+
+    def __init__(self, recording: Recording, speed: float = 1, copies: int = 1, host: str = '127.0.0.1',
+                 port: int = 0, start: float = None):
+        """Serve the recording from `start` (its first page by default) with its clock running `speed` times faster
+        than real time. With copies > 1, every recorded station is also served as copies - 1 synthetic stations named
+        <station>-2, <station>-3... that replay the same pages."""
+        self.recording = recording
+        self.speed = speed
+        self.start = recording.start if start is None else start
+        self.started = None  # type: Optional[float]
+        self.served = 0
+        self.sources = {}  # type: Dict[str, str]  # Served station -> recorded station
+        for stationName in recording.stations():
+            self.sources[stationName] = stationName
+            for copy in range(2, copies + 1):
+                self.sources['%s-%d' % (stationName, copy)] = stationName
+        self.server = ThreadingHTTPServer((host, port), _ReplayHandler)
+        self.server.daemon_threads = True
+        self.server.replay = self
+        self.thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def replayTime(self, now: float = None) -> float:
+        if self.started is None:
+            return self.start
+        return self.start + ((time.time() if now is None else now) - self.started) * self.speed
+
+    def freeze(self) -> None:
+        """Stop the replay clock where it is, so a collector can catch up with the pages served last."""
+        now = time.time()
+        self.start = self.replayTime(now)
+        self.started = now
+        self.speed = 0
+
+    @property
+    def done(self) -> bool:
+        """Whether the replay clock has passed the last recorded page."""
+        return self.replayTime() > self.recording.end
+
+    def status(self) -> dict:
+        return {'replayTime': self.replayTime(), 'start': self.start, 'end': self.recording.end, 'done': self.done,
+                'speed': self.speed, 'stations': len(self.sources), 'served': self.served}
+
+    def registry(self) -> StationRegistry:
+        """Every served station, with the parser it was recorded with and its URL on this server."""
+        return StationRegistry([Station(stationName, self.recording.parsers[source],
+                                        '%s/%s' % (self.url, quote(stationName, safe='')))
+                                for stationName, source in self.sources.items()])
+
+    def startInBackground(self) -> None:
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.server.serve_forever, name='replay', daemon=True)
+        self.thread.start()
+
+    def serveForever(self) -> None:
+        self.started = time.time()
+        self.server.serve_forever()
+
+    def close(self) -> None:
+        if self.thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+
+
+def referenceCollection(recording: Recording, until: float = None) -> StationPlayCollection:
+    """What collecting every recorded page (up to `until`) gives: each page parsed and stitched in fetch order. A
+    replay that was polled often enough should end up with the same plays."""
+    collection = StationPlayCollection()
+    for stationName in recording.stations():
+        station = Station(stationName, recording.parsers[stationName])
+        for index in range(recording.pageAt(stationName, recording.end if until is None else until) + 1):
+            songs = station.parse(recording.page(stationName, index))
+            if songs:
+                collection.add(stationName, songs)
+    return collection
+
+
+def compareWithReference(collected: StationPlayCollection, reference: StationPlayCollection,
+                         sources: Dict[str, str]) -> Dict[str, Dict[str, int]]:
+    """Compare each collected station's plays with the reference plays of the station it replayed (sources maps
+    station -> recorded station). Returns station -> {'expected', 'collected', 'missing', 'extra'}, counting plays of
+    each song."""
+    collectedStations = collected.getStations()
+    output = {}
+    for stationName, source in sources.items():
+        expected = Counter(reference[source].columns.songIds.tolist()) if source in reference.getStations() else Counter()
+        got = Counter(collected[stationName].columns.songIds.tolist()) if stationName in collectedStations else Counter()
+        output[stationName] = {'expected': sum(expected.values()), 'collected': sum(got.values()),
+                               'missing': sum((expected - got).values()), 'extra': sum((got - expected).values())}
+    return output
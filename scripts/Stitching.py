@@ -0,0 +1,89 @@
+from scripts.SongClasses import *
+
+"""
+Stitching
+    Merges a freshly fetched recently played list onto the plays already stored for a station. Stations that publish
+    play times are merged on (song, timestamp). Other stations are aligned by song order, using the longest suffix of
+    the stored plays that equals a prefix of the fetch, found in linear time with the KMP prefix function. Both work
+    with songs that repeat inside the window, and both report how confident the merge is.
+"""
+
+
+class StitchResult:
+
+    def __init__(self, newSongs: List[PlayedSong], overlap: int, confidence: float, alternatives: int = 0,
+                 usedTimestamps: bool = False):
+        self.newSongs = newSongs  # Songs to append, oldest first
+        self.overlap = overlap  # Fetched songs that matched stored plays
+        self.confidence = confidence  # 0 when nothing overlapped (plays may be missing), approaching 1 with more overlap
+        self.alternatives = alternatives  # Other, shorter alignments that would also have fit
+        self.usedTimestamps = usedTimestamps
+
+    @property
+    def gap(self) -> bool:
+        return self.overlap == 0
+
+    def __repr__(self):
+        return '<StitchResult %d new, overlap %d, confidence %.2f%s>' % (
+            len(self.newSongs), self.overlap, self.confidence, ', gap' if self.gap else '')
+
+
+def _overlapConfidence(overlap: int, alternatives: int = 0) -> float:
+    """Each matching song halves the chance that the alignment is a coincidence; other possible alignments split it."""
+    return (1 - 0.5 ** overlap) / (1 + alternatives)
+
+
+def _prefixFunction(sequence: list) -> List[int]:
+    """KMP prefix function: prefix[i] is the length of the longest proper prefix of sequence[:i+1] that is also its
+    suffix."""
+    prefix = [0] * len(sequence)
+    for i in range(1, len(sequence)):
+        k = prefix[i - 1]
+        while k and sequence[i] != sequence[k]:
+            k = prefix[k - 1]
+        if sequence[i] == sequence[k]:
+            k += 1
+        prefix[i] = k
+    return prefix
+
+
+def _chronological(fetched: List[PlayedSong], newestFirst: bool) -> Tuple[List[PlayedSong], bool]:
+    """Put a fetched list in play order, and tell whether it can be merged on its timestamps: the parser took them from
+    the station (rather than dating the songs when they were scraped) and they are all distinct."""
+    hasTimestamps = len(fetched) > 1 and hasPublishedTimes(fetched) and \
+        len(set(song.timestamp for song in fetched)) == len(fetched)
+    if hasTimestamps:
+        return sorted(fetched, key=lambda song: song.timestamp), True
+    return (fetched[::-1] if newestFirst else list(fetched)), False
+
+
+def stitchSongs(storedTail: List[PlayedSong], fetched: List[PlayedSong], newestFirst: bool = True) -> StitchResult:
+    """Work out which fetched songs are new plays. storedTail is the end of the station's stored plays (oldest first)
+    and should be at least as long as the fetch. Station pages list their newest song first."""
+    fetched, hasTimestamps = _chronological([song for song in fetched if song is not None], newestFirst)
+    if not storedTail:
+        return StitchResult(fetched, 0, 1.0, usedTimestamps=hasTimestamps)
+
+    # Merge by (song, play time) when the station publishes play times
+    if hasTimestamps:
+        storedKeys = set((song.song.id, song.stationId, song.timestamp) for song in storedTail)
+        oldest = min(song.timestamp for song in storedTail)
+        newSongs = [song for song in fetched if song.timestamp >= oldest and
+                    (song.song.id, song.stationId, song.timestamp) not in storedKeys]
+        overlap = len(fetched) - len(newSongs)
+        return StitchResult(newSongs, overlap, _overlapConfidence(overlap), usedTimestamps=True)
+
+    # Otherwise align by song order: the longest suffix of the stored tail that is also a prefix of the fetch
+    fetchedKeys = [(song.song.id, song.stationId) for song in fetched]
+    storedKeys = [(song.song.id, song.stationId) for song in storedTail]
+    prefix = _prefixFunction(fetchedKeys + [None] + storedKeys)
+    overlap = prefix[-1]
+
+    # Shorter alignments that also fit mean the overlap could be a repeat rather than the same plays
+    alternatives = 0
+    k = prefix[overlap - 1] if overlap else 0
+    while k:
+        alternatives += 1
+        k = prefix[k - 1]
+
+    return StitchResult(fetched[overlap:], overlap, _overlapConfidence(overlap, alternatives), alternatives)